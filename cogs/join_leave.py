@@ -1,9 +1,14 @@
+import asyncio
+import collections
 import logging
-import datetime
+import time
+
 import discord
 from discord.ext import commands
 
-from utils.storage import load_guild_config
+from utils import outbound
+from utils.storage import aload_guild_config, guild_config_version
+from utils.templating import EmbedTemplate, TemplateCache
 
 logger = logging.getLogger("JoinLeave")
 
@@ -20,89 +25,277 @@ def _parse_color(val, default=discord.Color.blurple()):
         pass
     return default
 
-def _render_vars(text, member, guild):
-    now = datetime.datetime.utcnow()
-    return (text or "").replace("{user}", member.mention)\
-        .replace("{user_id}", str(member.id))\
-        .replace("{created_at}", str(getattr(member, "created_at", "")))\
-        .replace("{member_count}", str(getattr(guild, "member_count", 0)))
-
-def _make_embed(embed_cfg, member, guild, fields_cfg):
-    e = discord.Embed(
-        title=_render_vars(embed_cfg.get("title", ""), member, guild),
-        description=_render_vars(embed_cfg.get("description", ""), member, guild),
-        color=_parse_color(embed_cfg.get("color", "#5865F2"), discord.Color.blurple())
-    )
+def _member_vars(member, guild):
+    created_at = str(getattr(member, "created_at", ""))
+    try:
+        avatar_url = str(member.display_avatar.url)
+    except Exception:
+        avatar_url = ""
+    return {
+        "user": member.mention,
+        "user_id": str(member.id),
+        "created_at": created_at,
+        "member_count": str(getattr(guild, "member_count", 0)),
+        "avatar_url": avatar_url,
+    }
+
+
+def _build_template(embed_cfg, fields_cfg):
+    """設定からEmbedの雛形を作る（描画時は変数の差し込みだけ）"""
+    fields = []
     # optional fields
     if fields_cfg.get("show_id", True):
-        e.add_field(name="ID", value=str(member.id), inline=True)
+        fields.append(("ID", "{user_id}", True))
     if fields_cfg.get("show_created_at", True):
-        e.add_field(name="作成日", value=str(getattr(member, "created_at", "")), inline=True)
+        fields.append(("作成日", "{created_at}", True))
     if fields_cfg.get("show_member_count", True):
-        e.add_field(name="メンバー数", value=str(getattr(guild, "member_count", 0)), inline=True)
-
-    if fields_cfg.get("show_avatar", True):
-        try:
-            e.set_thumbnail(url=member.display_avatar.url)
-        except Exception:
-            pass
+        fields.append(("メンバー数", "{member_count}", True))
 
     footer = embed_cfg.get("footer", {}) or {}
-    ft = (footer.get("text") or "").strip()
-    if ft:
-        e.set_footer(text=_render_vars(ft, member, guild))
-    return e
+    if not isinstance(footer, dict):
+        footer = {"text": str(footer)}  # Web画面の古い形式（文字列）
+    return EmbedTemplate(
+        title=embed_cfg.get("title", ""),
+        description=embed_cfg.get("description", ""),
+        color=_parse_color(embed_cfg.get("color", "#5865F2"), discord.Color.blurple()).value,
+        fields=fields,
+        footer=footer.get("text") or "",
+        thumbnail="{avatar_url}" if fields_cfg.get("show_avatar", True) else "",
+    )
+
+
+# 1メッセージに載せられるEmbed数と、全Embedの文字数合計の上限（Discordの制限）
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_EMBED_CHARS_PER_MESSAGE = 6000
+# まとめ一覧Embedの本文の上限（Discordの上限4096より少し余裕をもたせる。タイトル込みでも1通に収まる）
+SUMMARY_DESC_LIMIT = 3900
+
+_KIND_LABELS = {"join": "📥 参加", "leave": "📤 退出"}
+
+
+def _int(val, default, lo=1):
+    try:
+        return max(lo, int(val))
+    except (TypeError, ValueError):
+        return default
+
+
+def _burst_cfg(jl):
+    """jl.burst の設定（無効なら None）"""
+    b = jl.get("burst", {}) or {}
+    if not b.get("enabled", True):
+        return None
+    style = str(b.get("style", "list")).strip().lower()
+    return {
+        "threshold": _int(b.get("threshold"), 10, lo=2),
+        "window_seconds": _int(b.get("window_seconds"), 10),
+        "flush_seconds": _int(b.get("flush_seconds"), 5),
+        "style": style if style in ("list", "embeds") else "list",
+    }
+
+
+class _RateWindow:
+    """直近 window 秒のイベント数を数える"""
+
+    def __init__(self):
+        self._times = collections.deque()
+
+    def hit(self, now, window):
+        t = self._times
+        t.append(now)
+        while t and t[0] <= now - window:
+            t.popleft()
+        return len(t)
+
+
+def _pack_embeds(embeds):
+    """Embedを先頭から詰めて、1メッセージの上限（10個・合計6000文字）に収まるまとまりに分ける"""
+    group, size = [], 0
+    for e in embeds:
+        n = len(e)
+        if group and (len(group) >= MAX_EMBEDS_PER_MESSAGE or size + n > MAX_EMBED_CHARS_PER_MESSAGE):
+            yield group
+            group, size = [], 0
+        group.append(e)
+        size += n
+    if group:
+        yield group
+
+
+class _ChannelQueue:
+    """
+    チャンネルごとの送信キュー。送信は1チャンネルにつき1本ずつで、
+    待っている間に溜まった通知は1メッセージの上限（10Embed・合計6000文字）までまとめて送る。
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        # {"kind", "embed", "line", "color", "burst": まとめモード時の設定 or None}
+        self.items = []
+        self.task = None
+
+    def take(self, burst):
+        """先頭から同じモード（通常/まとめ）の通知を取り出す"""
+        n = 0
+        size = 0
+        for item in self.items:
+            if (item["burst"] is not None) != burst:
+                break
+            if not burst:
+                size += len(item["embed"])
+                if n and (n >= MAX_EMBEDS_PER_MESSAGE or size > MAX_EMBED_CHARS_PER_MESSAGE):
+                    break
+            n += 1
+        batch, self.items = self.items[:n], self.items[n:]
+        return batch
+
+
+def _summary_embeds(batch):
+    """まとめモードの一覧Embed（種別ごと、本文が長ければ分割）"""
+    out = []
+    for kind in ("join", "leave"):
+        rows = [x for x in batch if x["kind"] == kind]
+        if not rows:
+            continue
+        chunks = [[]]
+        size = 0
+        for x in rows:
+            if chunks[-1] and size + len(x["line"]) + 1 > SUMMARY_DESC_LIMIT:
+                chunks.append([])
+                size = 0
+            chunks[-1].append(x["line"])
+            size += len(x["line"]) + 1
+        for i, lines in enumerate(chunks):
+            title = "{} {}人（まとめ表示）".format(_KIND_LABELS[kind], len(rows))
+            if len(chunks) > 1:
+                title += " {}/{}".format(i + 1, len(chunks))
+            out.append(discord.Embed(title=title, description="\n".join(lines), color=rows[0]["color"]))
+    return out
 
 
 class JoinLeave(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self._templates = TemplateCache()  # (gid, "join"/"leave") -> EmbedTemplate
+        self._rates = {}     # (gid, kind) -> _RateWindow
+        self._bursting = set()  # まとめモード中の (gid, kind)
+        self._queues = {}    # channel_id -> _ChannelQueue
+
+    def cog_unload(self):
+        for q in list(self._queues.values()):
+            if q.task:
+                q.task.cancel()
+
+    def _template(self, kind, version, jl, guild_id):
+        return self._templates.get(
+            guild_id, kind, version,
+            lambda: _build_template(jl.get(kind + "_embed", {}) or {}, jl.get("fields", {}) or {}),
+        )
+
+    def _burst_state(self, gid, kind, jl):
+        """参加/退出のペースが閾値を超えている間はまとめモード（設定を返す）"""
+        b = _burst_cfg(jl)
+        key = (gid, kind)
+        rate = self._rates.get(key)
+        if rate is None:
+            rate = self._rates[key] = _RateWindow()
+        count = rate.hit(time.monotonic(), b["window_seconds"] if b else 10)
+
+        if b is None or count < b["threshold"]:
+            if key in self._bursting:
+                self._bursting.discard(key)
+                logger.info("burst mode off: guild=%s kind=%s", gid, kind)
+            return None
+        if key not in self._bursting:
+            self._bursting.add(key)
+            logger.warning("burst mode on: guild=%s kind=%s (%d in %ss)", gid, kind, count, b["window_seconds"])
+        return b
+
+    async def _announce(self, member, kind):
+        # 読み込み前のバージョンで覚える（途中で変わっても次回作り直される）
+        version = guild_config_version(member.guild.id)
+        cfg = await aload_guild_config(member.guild.id, readonly=True)
+        jl = cfg.get("jl", {})
+        if not jl.get("enabled", False):
+            return
+        if jl.get("filter", {}).get("ignore_bots", True) and member.bot:
+            return
+
+        ch_id = str(jl.get("channel_" + kind, "")).strip()
+        if not ch_id.isdigit():
+            return
+        ch = member.guild.get_channel(int(ch_id))
+        if not ch:
+            return
+
+        tpl = self._template(kind, version, jl, member.guild.id)
+        burst = self._burst_state(member.guild.id, kind, jl)
+        item = {
+            "kind": kind,
+            "embed": None,
+            "line": "{} ({})".format(member.mention, discord.utils.escape_markdown(str(member))),
+            "color": tpl.color,
+            "burst": burst,
+        }
+        # 一覧表示なら個別のEmbedは作らない
+        if burst is None or burst["style"] == "embeds":
+            item["embed"] = discord.Embed.from_dict(tpl.build(_member_vars(member, member.guild)))
+        self._enqueue(ch, item)
+
+    def _enqueue(self, channel, item):
+        q = self._queues.get(channel.id)
+        if q is None:
+            q = self._queues[channel.id] = _ChannelQueue(channel)
+        q.items.append(item)
+        if q.task is None or q.task.done():
+            q.task = asyncio.create_task(self._drain(q))
+
+    async def _drain(self, q):
+        try:
+            while q.items:
+                try:
+                    burst = q.items[0]["burst"]
+                    if burst is None:
+                        await self._send(q.channel, [x["embed"] for x in q.take(False)])
+                        continue
+                    # まとめモード：しばらく溜めてからまとめて送る
+                    await asyncio.sleep(burst["flush_seconds"])
+                    batch = q.take(True)
+                    # 途中で style が変わることがあるので1件ずつ見る（個別Embedがあればそれ、無ければ一覧の1行）
+                    embeds = [x["embed"] for x in batch if x["embed"] is not None]
+                    embeds += _summary_embeds([x for x in batch if x["embed"] is None])
+                    for group in _pack_embeds(embeds):
+                        await self._send(q.channel, group)
+                except Exception:
+                    # 1回分が失敗してもキューは止めない
+                    logger.exception("join/leave drain failed: channel=%s", getattr(q.channel, "id", None))
+        finally:
+            if not q.items and self._queues.get(q.channel.id) is q:
+                del self._queues[q.channel.id]
+
+    async def _send(self, channel, embeds):
+        if not embeds:
+            return
+        try:
+            route = outbound.channel_route(channel)
+            if len(embeds) == 1:
+                await outbound.call(self.bot, route, outbound.NOTIFY, channel.send, embed=embeds[0])
+            else:
+                await outbound.call(self.bot, route, outbound.NOTIFY, channel.send, embeds=embeds)
+        except Exception:
+            logger.exception("join/leave send failed: channel=%s", getattr(channel, "id", None))
 
     @commands.Cog.listener()
     async def on_member_join(self, member):
         try:
-            cfg = load_guild_config(member.guild.id)
-            jl = cfg.get("jl", {})
-            if not jl.get("enabled", False):
-                return
-            if jl.get("filter", {}).get("ignore_bots", True) and member.bot:
-                return
-
-            ch_id = str(jl.get("channel_join", "")).strip()
-            if not ch_id.isdigit():
-                return
-            ch = member.guild.get_channel(int(ch_id))
-            if not ch:
-                return
-
-            emb_cfg = jl.get("join_embed", {}) or {}
-            fields_cfg = jl.get("fields", {}) or {}
-            embed = _make_embed(emb_cfg, member, member.guild, fields_cfg)
-            await ch.send(embed=embed)
+            await self._announce(member, "join")
         except Exception:
             logger.exception("on_member_join failed")
 
     @commands.Cog.listener()
     async def on_member_remove(self, member):
         try:
-            cfg = load_guild_config(member.guild.id)
-            jl = cfg.get("jl", {})
-            if not jl.get("enabled", False):
-                return
-            if jl.get("filter", {}).get("ignore_bots", True) and member.bot:
-                return
-
-            ch_id = str(jl.get("channel_leave", "")).strip()
-            if not ch_id.isdigit():
-                return
-            ch = member.guild.get_channel(int(ch_id))
-            if not ch:
-                return
-
-            emb_cfg = jl.get("leave_embed", {}) or {}
-            fields_cfg = jl.get("fields", {}) or {}
-            embed = _make_embed(emb_cfg, member, member.guild, fields_cfg)
-            await ch.send(embed=embed)
+            await self._announce(member, "leave")
         except Exception:
             logger.exception("on_member_remove failed")
 
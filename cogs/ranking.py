@@ -1,35 +1,54 @@
 import asyncio
+import hashlib
 import json
 import logging
 import time
 import math
-from pathlib import Path
+import os
+import random
 
 import discord
 from discord import app_commands
 from discord.ext import commands
 
-from utils.storage import load_guild_config, save_guild_config
+from utils import member_names, outbound
+from utils.ranking_index import RankBoard, overall_score
+from utils.scheduler import DeadlineQueue
+from utils.storage import (
+    CounterStore,
+    abackend,
+    add_config_listener,
+    aload_guild_config,
+    aupdate_guild_config,
+    get_backend,
+    guild_config_version,
+    remove_config_listener,
+    run_io,
+)
+from utils.templating import EmbedTemplate, TemplateCache
 
 logger = logging.getLogger("Ranking")
 
-DATA_DIR = Path("data/ranking")
-DATA_DIR.mkdir(parents=True, exist_ok=True)
+# テキストカウンタの書き出し間隔（秒）と、即時書き出しする未保存件数
+TEXT_FLUSH_INTERVAL = int(os.getenv("RANK_FLUSH_INTERVAL", "30"))
+TEXT_FLUSH_THRESHOLD = int(os.getenv("RANK_FLUSH_THRESHOLD", "500"))
 
-def _p_text(gid): return DATA_DIR / ("text_{}.json".format(gid))
-def _p_vc(gid): return DATA_DIR / ("vc_{}.json".format(gid))
+# VC滞在時間を加算する間隔（秒）。加算とセッションのチェックポイントは1tickにつき1回書き出す
+VC_TICK_INTERVAL = int(os.getenv("RANK_VC_TICK", "60"))
+# 再起動をまたいでVCに居続けたとみなす最大の空白（秒）。これを超えた分は加算しない
+VC_RESUME_GRACE = int(os.getenv("RANK_VC_RESUME_GRACE", "300"))
 
-def _load_json(p):
-    if not p.exists():
-        p.write_text("{}", encoding="utf-8")
-    try:
-        raw = p.read_text(encoding="utf-8").strip()
-        return json.loads(raw) if raw else {}
-    except Exception:
-        return {}
+# リーダーボード更新間隔のゆらぎ（±割合）。同じ間隔のギルドが同じ瞬間に更新しないように
+LB_JITTER = 0.1
+# 設定変更からリーダーボードへ反映するまでの最大遅延（秒）
+LB_CHANGE_DELAY = 5
 
-def _save_json(p, data):
-    p.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+# リーダーボードに出せる件数の上限（フィールドに入りきらない行は「…ほかN件」にまとめる）
+MAX_TOP_K = 25
+# Discord の Embed の上限（フィールド値 / Embed 全体、文字数）と、リーダーボードに出す名前の長さ
+EMBED_FIELD_MAX = 1024
+EMBED_TOTAL_MAX = 6000
+LB_NAME_MAX = 32
 
 def _parse_color(val, default=discord.Color.blurple()):
     try:
@@ -49,10 +68,33 @@ def _fmt_vc(seconds):
     m = (seconds % 3600) // 60
     return "{}h {}m".format(h, m)
 
-def _top5(d):
-    items = [(k, d.get(k, 0)) for k in d.keys()]
-    items.sort(key=lambda x: x[1], reverse=True)
-    return items[:5]
+def _short(s, n=LB_NAME_MAX):
+    s = str(s)
+    return s if len(s) <= n else s[:n - 1] + "…"
+
+def _fit_lines(lines, limit):
+    """limit 文字に収まるところまで行を並べ、入りきらない行は「…ほかN件」にまとめる"""
+    text = "\n".join(lines)
+    if len(text) <= limit:
+        return text
+    reserve = len("\n…ほか{}件".format(len(lines)))
+    out = []
+    n = 0
+    for line in lines:
+        add = len(line) + (1 if out else 0)
+        if n + add + reserve > limit:
+            break
+        out.append(line)
+        n += add
+    out.append("…ほか{}件".format(len(lines) - len(out)))
+    return "\n".join(out)
+
+def _top_k(lb):
+    try:
+        k = int(lb.get("top_k", 5))
+    except (TypeError, ValueError):
+        k = 5
+    return max(1, min(MAX_TOP_K, k))
 
 def _calc_level_from_xp(xp):
     """
@@ -65,26 +107,72 @@ def _calc_level_from_xp(xp):
     next_xp = int((level + 1) ** 2 * 100)
     return level, xp, next_xp
 
-def _apply_vars(text, mapping):
-    s = str(text or "")
-    for k, v in mapping.items():
-        s = s.replace("{" + k + "}", str(v))
-    return s
+def _embed_digest(embed):
+    """Embedの内容のハッシュ（前回と同じなら編集しない）"""
+    raw = json.dumps(embed.to_dict(), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def _rank_template(emb_cfg):
+    """/rank のEmbed雛形（設定が変わるまで使い回す）"""
+    return EmbedTemplate(
+        title=emb_cfg.get("title", "ランク - {username}"),
+        description=emb_cfg.get("description", ""),
+        color=_parse_color(emb_cfg.get("color", "#6D7CFF"), discord.Color.blurple()).value,
+        fields=[(f.get("name", ""), f.get("value", ""), f.get("inline", True))
+                for f in (emb_cfg.get("fields", []) or []) if isinstance(f, dict)],
+        footer=(emb_cfg.get("footer", {}) or {}).get("text", ""),
+    )
 
 
 class Ranking(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self._vc_sessions = {}  # (gid, uid) -> join_time
+        self._vc_sessions = {}  # (gid, uid) -> 最後に加算した時刻（epoch）
+        self._vc_restored = False
+        self._text = CounterStore("text")
+        self._vc = CounterStore("vc")
+        self._boards = {}  # gid -> RankBoard（リーダーボード表示時に作成、以後は差分更新）
+        self._last_names = {}  # gid -> {uid: 最後に見えた表示名}（今のリーダーボードに載っている人だけ保存）
+        self._templates = TemplateCache()  # (gid, "rank") -> EmbedTemplate
+        self._lb_due = DeadlineQueue()  # gid -> 次にリーダーボードを更新する時刻
+        self._lb_intervals = {}  # gid -> 更新間隔（秒）
+        self._lb_versions = {}  # gid -> 予定を作った時の設定バージョン
+        add_config_listener(self._on_config_change)
         self._task = self.bot.loop.create_task(self._leaderboard_loop())
-        self._lb_last = {}
+        self._flush_task = self.bot.loop.create_task(self._flush_loop())
+        self._vc_task = self.bot.loop.create_task(self._vc_loop())
+        # gid -> {"channel_id", "message_id", "message"(Partial)Message, "digest"}（毎回 fetch しない）
+        self._lb_msgs = {}
+        # リーダーボード更新の回数（内容が同じでスキップ / 編集 / 新規送信）
+        self.lb_stats = {"skipped": 0, "edited": 0, "sent": 0}
 
     def cog_unload(self):
+        remove_config_listener(self._on_config_change)
+        for task in (self._task, self._flush_task, self._vc_task):
+            try:
+                if task:
+                    task.cancel()
+            except Exception:
+                pass
+        # ✅ 終了時に未保存分を書き出す（VCは終了時刻まで加算）
         try:
-            if self._task:
-                self._task.cancel()
+            self._accrue_vc()
+            self._vc.flush()
+            get_backend().save_vc_sessions(self._vc_sessions_snapshot())
         except Exception:
-            pass
+            logger.exception("vc flush failed")
+        try:
+            self._text.flush()
+        except Exception:
+            logger.exception("counter flush failed")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(TEXT_FLUSH_INTERVAL)
+            try:
+                await self._text.aflush()
+            except Exception:
+                logger.exception("text counter flush failed")
 
     @commands.Cog.listener()
     async def on_message(self, message):
@@ -92,43 +180,121 @@ class Ranking(commands.Cog):
             return
         gid = message.guild.id
         uid = str(message.author.id)
+        await self._text.aget(gid)
+        self._text.incr(gid, uid)
+        names = getattr(self.bot, "member_names", None)
+        if names is not None:
+            # 発言者の名前を覚えておく（退出後もリーダーボードに名前を出せる）
+            names.remember(message.author)
+        board = self._boards.get(gid)
+        if board is not None:
+            board.on_text(uid)
+        if self._text.pending >= TEXT_FLUSH_THRESHOLD:
+            try:
+                await self._text.aflush()
+            except Exception:
+                logger.exception("text counter flush failed")
 
-        p = _p_text(gid)
-        data = _load_json(p)
-        data[uid] = int(data.get(uid, 0)) + 1
-        _save_json(p, data)
-
+    # -------------------------
+    # VC sessions
+    # -------------------------
     @commands.Cog.listener()
     async def on_voice_state_update(self, member, before, after):
         if not member.guild:
             return
-        gid = member.guild.id
-        uid = str(member.id)
-        key = (gid, uid)
+        key = (member.guild.id, str(member.id))
 
         if before.channel is None and after.channel is not None:
             self._vc_sessions[key] = time.time()
             return
 
         if before.channel is not None and after.channel is None:
-            start = self._vc_sessions.pop(key, None)
-            if start:
-                sec = int(time.time() - start)
-                p = _p_vc(gid)
-                data = _load_json(p)
-                data[uid] = int(data.get(uid, 0)) + sec
-                _save_json(p, data)
+            last = self._vc_sessions.pop(key, None)
+            if last:
+                await self._vc.aget(key[0])
+                self._credit_vc(key[0], key[1], int(time.time() - last))
             return
+        # チャンネル移動はセッション継続（tickで加算され続ける）
 
-        if before.channel is not None and after.channel is not None and before.channel.id != after.channel.id:
-            start = self._vc_sessions.get(key)
-            if start:
-                sec = int(time.time() - start)
-                p = _p_vc(gid)
-                data = _load_json(p)
-                data[uid] = int(data.get(uid, 0)) + sec
-                _save_json(p, data)
-            self._vc_sessions[key] = time.time()
+    def _credit_vc(self, gid, uid, sec):
+        if sec <= 0:
+            return
+        self._vc.incr(gid, uid, sec)
+        board = self._boards.get(gid)
+        if board is not None:
+            board.on_vc(str(uid))
+
+    def _accrue_vc(self):
+        """参加中の全セッションを今まで加算する（メモリのみ）"""
+        now = time.time()
+        for key, last in list(self._vc_sessions.items()):
+            sec = int(now - last)
+            if sec > 0:
+                self._credit_vc(key[0], key[1], sec)
+                self._vc_sessions[key] = last + sec
+
+    def _vc_sessions_snapshot(self):
+        sessions = {}
+        for (gid, uid), last in self._vc_sessions.items():
+            sessions.setdefault(str(gid), {})[uid] = last
+        return sessions
+
+    async def _vc_tick(self):
+        """加算して、カウンタとセッションを1回ずつ書き出す"""
+        for gid in {k[0] for k in self._vc_sessions}:
+            await self._vc.aget(gid)
+        self._accrue_vc()
+        await self._vc.aflush()
+        await run_io(("vc_sessions",), get_backend().save_vc_sessions, self._vc_sessions_snapshot())
+
+    async def _sync_vc_sessions(self):
+        """
+        Discord上の現在のVC状態とセッションを突き合わせる（起動時/再接続時）。
+        初回はチェックポイントを読み、VC_RESUME_GRACE 以内の空白なら居続けたとみなして続きから加算する。
+        """
+        now = time.time()
+        saved = {}
+        if not self._vc_restored:
+            self._vc_restored = True
+            try:
+                saved_all = await run_io(("vc_sessions",), get_backend().load_vc_sessions)
+                for gid, users in saved_all.items():
+                    for uid, last in users.items():
+                        saved[(int(gid), str(uid))] = float(last)
+            except Exception:
+                logger.exception("failed to load vc sessions")
+
+        present = set()
+        for g in list(self.bot.guilds):
+            for ch in list(g.voice_channels) + list(g.stage_channels):
+                for mid in ch.voice_states.keys():
+                    present.add((g.id, str(mid)))
+
+        # 居なくなった人は最後のtickまでで確定
+        for key in [k for k in self._vc_sessions if k not in present]:
+            del self._vc_sessions[key]
+
+        for key in present:
+            if key in self._vc_sessions:
+                continue
+            last = saved.get(key)
+            self._vc_sessions[key] = last if last and now - last <= VC_RESUME_GRACE else now
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        try:
+            await self._sync_vc_sessions()
+        except Exception:
+            logger.exception("vc session sync failed")
+
+    async def _vc_loop(self):
+        await self.bot.wait_until_ready()
+        while not self.bot.is_closed():
+            await asyncio.sleep(VC_TICK_INTERVAL)
+            try:
+                await self._vc_tick()
+            except Exception:
+                logger.exception("vc tick failed")
 
     @app_commands.command(name="rank", description="あなたのランク情報を表示します（Embed）")
     async def rank_cmd(self, interaction: discord.Interaction):
@@ -136,7 +302,8 @@ class Ranking(commands.Cog):
             await interaction.response.send_message("サーバー内で実行してください。", ephemeral=True)
             return
 
-        cfg = load_guild_config(interaction.guild.id)
+        version = guild_config_version(interaction.guild.id)
+        cfg = await aload_guild_config(interaction.guild.id, readonly=True)
         if not cfg.get("rank", {}).get("enabled", True):
             await interaction.response.send_message("Rankingは無効です。", ephemeral=True)
             return
@@ -144,8 +311,8 @@ class Ranking(commands.Cog):
         gid = interaction.guild.id
         uid = str(interaction.user.id)
 
-        text = _load_json(_p_text(gid))
-        vc = _load_json(_p_vc(gid))
+        text = await self._text.aget(gid)
+        vc = await self._vc.aget(gid)
 
         messages = int(text.get(uid, 0))
         vc_sec = int(vc.get(uid, 0))
@@ -155,7 +322,12 @@ class Ranking(commands.Cog):
         level, xp, next_xp = _calc_level_from_xp(messages)
 
         # 既存互換のために追加変数も用意
-        overall_score = int((messages + (vc_sec // 60)) / 2)
+        overall = overall_score(messages, vc_sec)
+
+        # 順位（総合スコア基準、O(log n)）
+        board = await self._board(gid, _top_k(cfg.get("rank", {}).get("leaderboard", {}) or {}))
+        position = board.index.position(uid)
+        percentile = board.index.percentile(uid)
 
         mapping = {
             "user": interaction.user.mention,
@@ -168,67 +340,96 @@ class Ranking(commands.Cog):
 
             "text_count": messages,
             "vc_time": _fmt_vc(vc_sec),
-            "overall_score": overall_score
+            "overall_score": overall,
+            "position": position if position is not None else "-",
+            "percentile": "{:.1f}".format(percentile) if percentile is not None else "-",
+            "total_ranked": board.index.total
         }
 
-        emb_cfg = cfg.get("rank", {}).get("embed", {}) or {}
-        title = _apply_vars(emb_cfg.get("title", "ランク - {username}"), mapping)
-        desc = _apply_vars(emb_cfg.get("description", ""), mapping)
-
-        e = discord.Embed(
-            title=title,
-            description=desc,
-            color=_parse_color(emb_cfg.get("color", "#6D7CFF"), discord.Color.blurple())
+        tpl = self._templates.get(
+            gid, "rank", version,
+            lambda: _rank_template(cfg.get("rank", {}).get("embed", {}) or {}),
         )
-
-        for f in (emb_cfg.get("fields", []) or []):
-            name = _apply_vars(f.get("name", ""), mapping)
-            value = _apply_vars(f.get("value", ""), mapping)
-            e.add_field(name=name, value=value, inline=bool(f.get("inline", True)))
-
-        footer = (emb_cfg.get("footer", {}) or {}).get("text", "")
-        if footer:
-            e.set_footer(text=_apply_vars(footer, mapping))
+        e = discord.Embed.from_dict(tpl.build(mapping))
 
         await interaction.response.send_message(embed=e, ephemeral=True)
 
-    def _build_leaderboard_embed(self, guild):
-        gid = guild.id
-        text = _load_json(_p_text(gid))
-        vc = _load_json(_p_vc(gid))
+    async def _board(self, gid, k):
+        board = self._boards.get(gid)
+        if board is None or board.k != k:
+            # 初回/件数変更時だけ全件から作る。以後は on_message/VC で差分更新
+            board = RankBoard(await self._text.aget(gid), await self._vc.aget(gid), k)
+            self._boards[gid] = board
+        return board
 
-        overall_map = {}
-        for uid in set(list(text.keys()) + list(vc.keys())):
-            t = int(text.get(uid, 0))
-            vmin = int(int(vc.get(uid, 0)) // 60)
-            overall_map[uid] = int((t + vmin) / 2)
+    async def _leaderboard_names(self, guild, uids):
+        """
+        表示名をまとめて解決する。見つからない人（退出済みなど）は
+        最後に見えた表示名（保存済み）→ Botのユーザーキャッシュ の順で補う。
+        """
+        names = await member_names.resolve(self.bot, guild, uids)
+        key = ("last_names", str(guild.id))
+        last = self._last_names.get(guild.id)
+        if last is None:
+            last = await abackend(key, "load_last_names", guild.id)
+            last = self._last_names.setdefault(guild.id, last)
+
+        # 保存するのは今のリーダーボードに載っている人だけ（圏外に落ちた人は消して、増え続けないようにする）
+        keep = {}
+        for uid in dict.fromkeys(str(u) for u in uids):
+            name = names.get(uid)
+            if not name:
+                user = self.bot.get_user(int(uid)) if uid.isdigit() else None
+                name = last.get(uid) or (user.display_name if user else None)
+                names[uid] = name
+            if name:
+                keep[uid] = name
+        if keep != last:
+            self._last_names[guild.id] = keep
+            try:
+                await abackend(key, "save_last_names", guild.id, dict(keep))
+            except Exception:
+                logger.exception("failed to save member names: guild=%s", guild.id)
+        return names
+
+    async def _build_leaderboard_embed(self, guild, top_k=5):
+        board = await self._board(guild.id, top_k)
+        top_text = board.top_text.items()
+        top_vc = board.top_vc.items()
+        top_overall = board.top_overall.items()
 
-        top_text = _top5(text)
-        top_vc = _top5(vc)
-        top_overall = _top5(overall_map)
+        # 表示名はまとめて解決（キャッシュ → メンバーキャッシュ → query_members → 保存済みの名前）
+        uids = [uid for items in (top_text, top_vc, top_overall) for uid, _ in items]
+        names = await self._leaderboard_names(guild, uids)
 
-        def fmt_list(items, mode):
+        def fmt_list(items, mode, limit):
             lines = []
             for i, (uid, val) in enumerate(items, start=1):
-                m = guild.get_member(int(uid)) if str(uid).isdigit() else None
-                name = m.display_name if m else "User {}".format(uid)
+                name = _short(names.get(str(uid)) or "User {}".format(uid))
                 s = _fmt_vc(val) if mode == "vc" else str(val)
                 lines.append("`#{}` {} — **{}**".format(i, name, s))
-            return "\n".join(lines) if lines else "（データなし）"
-
-        e = discord.Embed(
-            title="🏆 Leaderboard Top5",
-            description="テキスト / VC / 総合（平均）を自動更新します。",
-            color=discord.Color.blurple()
-        )
-        e.add_field(name="💬 テキスト Top5", value=fmt_list(top_text, "text"), inline=False)
-        e.add_field(name="🎙️ VC Top5", value=fmt_list(top_vc, "vc"), inline=False)
-        e.add_field(name="✨ 総合 Top5", value=fmt_list(top_overall, "overall"), inline=False)
-        e.set_footer(text="自動更新中")
+            return _fit_lines(lines, limit) if lines else "（データなし）"
+
+        title = "🏆 Leaderboard Top{}".format(top_k)
+        description = "テキスト / VC / 総合（平均）を自動更新します。"
+        footer = "自動更新中"
+        fields = [
+            ("💬 テキスト Top{}".format(top_k), top_text, "text"),
+            ("🎙️ VC Top{}".format(top_k), top_vc, "vc"),
+            ("✨ 総合 Top{}".format(top_k), top_overall, "overall"),
+        ]
+        # フィールド値は1つ1024文字まで、かつ Embed 全体（タイトル等込み）で6000文字まで
+        fixed = len(title) + len(description) + len(footer) + sum(len(n) for n, _, _ in fields)
+        limit = min(EMBED_FIELD_MAX, (EMBED_TOTAL_MAX - fixed) // len(fields))
+
+        e = discord.Embed(title=title, description=description, color=discord.Color.blurple())
+        for name, items, mode in fields:
+            e.add_field(name=name, value=fmt_list(items, mode, limit), inline=False)
+        e.set_footer(text=footer)
         return e
 
     async def deploy_or_update_leaderboard(self, guild, force_send=False):
-        cfg = load_guild_config(guild.id)
+        cfg = await aload_guild_config(guild.id, readonly=True)
         lb = cfg.get("rank", {}).get("leaderboard", {}) or {}
         if not lb.get("enabled", False) and not force_send:
             return None
@@ -240,22 +441,50 @@ class Ranking(commands.Cog):
         if not ch:
             return None
 
-        embed = self._build_leaderboard_embed(guild)
+        embed = await self._build_leaderboard_embed(guild, _top_k(lb))
+        digest = _embed_digest(embed)
+
+        # 定期更新はバックグラウンド扱い（Webからの設置はユーザー操作として優先）
+        route = outbound.channel_route(ch)
+        prio = outbound.INTERACTIVE if force_send else outbound.BACKGROUND
 
         msg_id = str(lb.get("message_id", "")).strip()
         if msg_id.isdigit() and not force_send:
+            cached = self._lb_msgs.get(guild.id)
+            if cached and cached["channel_id"] == ch.id and cached["message_id"] == int(msg_id):
+                if cached["digest"] == digest:
+                    self.lb_stats["skipped"] += 1
+                    return cached["message"]
+                m = cached["message"]
+            else:
+                # ✅ fetch_message せずに部分メッセージで編集（無ければ NotFound → 新規送信）
+                m = ch.get_partial_message(int(msg_id))
             try:
-                m = await ch.fetch_message(int(msg_id))
-                await m.edit(embed=embed)
+                m = await outbound.call(self.bot, route, prio, m.edit, embed=embed) or m
+                self._remember_lb(guild.id, ch.id, m, digest)
+                self.lb_stats["edited"] += 1
                 return m
             except Exception:
-                pass
+                self._lb_msgs.pop(guild.id, None)
+
+        m = await outbound.call(self.bot, route, prio, ch.send, embed=embed)
+        self._remember_lb(guild.id, ch.id, m, digest)
+        self.lb_stats["sent"] += 1
 
-        m = await ch.send(embed=embed)
-        cfg["rank"]["leaderboard"]["message_id"] = str(m.id)
-        save_guild_config(guild.id, cfg)
+        # 送信を待つ間にWebから保存されていても消さないよう、保存は最新の設定に対して行う
+        def _set_message(c):
+            c.setdefault("rank", {}).setdefault("leaderboard", {})["message_id"] = str(m.id)
+        await aupdate_guild_config(guild.id, _set_message)
         return m
 
+    def _remember_lb(self, gid, channel_id, message, digest):
+        self._lb_msgs[gid] = {
+            "channel_id": channel_id,
+            "message_id": message.id,
+            "message": message,
+            "digest": digest,
+        }
+
     # ✅ Webの「Discordに設置」ボタン用：これが無いとapi_rank_deployが動かない
     async def deploy_leaderboard(self, channel: discord.TextChannel):
         """
@@ -266,42 +495,78 @@ class Ranking(commands.Cog):
         - 送信して message_id を保存
         """
         guild = channel.guild
-        cfg = load_guild_config(guild.id)
-        cfg.setdefault("rank", {})
-        cfg["rank"].setdefault("leaderboard", {})
 
-        cfg["rank"]["leaderboard"]["enabled"] = True
-        cfg["rank"]["leaderboard"]["channel_id"] = str(channel.id)
-        cfg["rank"]["leaderboard"]["message_id"] = ""  # 新規で送る
-        # interval_minutes は既存値を尊重（無ければ10）
-        if "interval_minutes" not in cfg["rank"]["leaderboard"]:
-            cfg["rank"]["leaderboard"]["interval_minutes"] = 10
+        def _enable(cfg):
+            cfg.setdefault("rank", {})
+            cfg["rank"].setdefault("leaderboard", {})
 
-        save_guild_config(guild.id, cfg)
+            cfg["rank"]["leaderboard"]["enabled"] = True
+            cfg["rank"]["leaderboard"]["channel_id"] = str(channel.id)
+            cfg["rank"]["leaderboard"]["message_id"] = ""  # 新規で送る
+            # interval_minutes は既存値を尊重（無ければ10）
+            if "interval_minutes" not in cfg["rank"]["leaderboard"]:
+                cfg["rank"]["leaderboard"]["interval_minutes"] = 10
+
+        await aupdate_guild_config(guild.id, _enable)
 
         m = await self.deploy_or_update_leaderboard(guild, force_send=True)
         return m
 
+    # -------------------------
+    # leaderboard scheduler
+    # -------------------------
+    def _on_config_change(self, gid):
+        # Webで保存されたらすぐにループを起こして予定を作り直す
+        self._lb_due.wake()
+
+    async def _schedule_leaderboard(self, gid):
+        first = gid not in self._lb_versions
+        cfg = await aload_guild_config(gid, readonly=True)
+        self._lb_versions[gid] = guild_config_version(gid)
+
+        lb = cfg.get("rank", {}).get("leaderboard", {}) or {}
+        if not lb.get("enabled", False) or not str(lb.get("channel_id", "")).strip().isdigit():
+            self._lb_due.cancel(gid)
+            self._lb_intervals.pop(gid, None)
+            return
+
+        interval = max(1, int(lb.get("interval_minutes", 10))) * 60
+        self._lb_intervals[gid] = interval
+        if first:
+            # 起動直後は間隔全体にばらけさせる（全ギルドが同時に更新しない）
+            delay = random.uniform(0, interval)
+        else:
+            # 設定変更はすぐ反映（内容が同じなら編集はスキップされる）
+            delay = random.uniform(0, LB_CHANGE_DELAY)
+        self._lb_due.schedule(gid, time.time() + delay)
+
+    async def _refresh_leaderboard(self, gid):
+        guild = self.bot.get_guild(gid)
+        if guild is None:
+            self._lb_versions.pop(gid, None)
+            self._lb_intervals.pop(gid, None)
+            return
+        try:
+            await self.deploy_or_update_leaderboard(guild, force_send=False)
+        except Exception:
+            logger.exception("leaderboard update failed: guild=%s", gid)
+        interval = self._lb_intervals.get(gid)
+        if interval:
+            self._lb_due.schedule(gid, time.time() + interval * (1 + random.uniform(-LB_JITTER, LB_JITTER)))
+
     async def _leaderboard_loop(self):
         await self.bot.wait_until_ready()
         while not self.bot.is_closed():
             try:
-                now = time.time()
+                # 初回 + 設定が変わったギルドだけ予定を作り直す（変化が無ければディスクI/Oなし）
                 for g in list(self.bot.guilds):
-                    cfg = load_guild_config(g.id)
-                    lb = cfg.get("rank", {}).get("leaderboard", {}) or {}
-                    if not lb.get("enabled", False):
-                        continue
-                    interval = int(lb.get("interval_minutes", 10))
-                    last = float(self._lb_last.get(g.id, 0))
-                    if now - last < interval * 60:
-                        continue
-                    await self.deploy_or_update_leaderboard(g, force_send=False)
-                    self._lb_last[g.id] = now
+                    if self._lb_versions.get(g.id) != guild_config_version(g.id):
+                        await self._schedule_leaderboard(g.id)
+                for gid in self._lb_due.pop_due():
+                    await self._refresh_leaderboard(gid)
             except Exception:
                 logger.exception("leaderboard loop error")
-            await asyncio.sleep(30)
-
+            await self._lb_due.wait()
 
 async def setup(bot):
     await bot.add_cog(Ranking(bot))
@@ -1,19 +1,25 @@
-import asyncio
 import logging
-import json
 import datetime
-from pathlib import Path
+import time
 
 import discord
 from discord.ext import commands
 
-from utils.storage import load_guild_config
+from utils import outbound, ticket_logs
+from utils.scheduler import DeadlineQueue
+from utils.storage import (
+    abackend,
+    add_config_listener,
+    aload_guild_config,
+    get_backend,
+    guild_config_version,
+    remove_config_listener,
+    run_io,
+)
+from utils.templating import render
 
 logger = logging.getLogger("TicketSystem")
 
-TICKET_DIR = Path("data/tickets")
-TICKET_DIR.mkdir(parents=True, exist_ok=True)
-
 
 def now_iso():
     return datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
@@ -30,34 +36,158 @@ def parse_iso(s):
         return None
 
 
-def ticket_store_path(gid):
-    return TICKET_DIR / f"{gid}.json"
+def iso_to_ts(s):
+    dt = parse_iso(s)
+    return dt.replace(tzinfo=datetime.timezone.utc).timestamp() if dt else None
+
+
+# last_message_at / トランスクリプトの書き出し間隔（秒）
+ACTIVITY_FLUSH_INTERVAL = 60
+# 書き出し予定を _deadlines に載せる時のキー（チケットの (gid, ticket_id) とは重ならない）
+FLUSH_KEY = ("flush", None)
+# 書き出し待ちのトランスクリプトがこの行数を超えたら間隔を待たずに書き出す
+TRANSCRIPT_FLUSH_LINES = 200
+
+# Web管理画面のチケットログ一覧に載せる項目
+INDEX_FIELDS = ("ticket_id", "panel_index", "count", "user_id", "status", "type", "urgency",
+                "created_at", "closed_at", "channel_id", "thread_id")
 
 
 def load_store(gid):
-    p = ticket_store_path(gid)
-    if not p.exists():
-        p.write_text(json.dumps({"tickets": []}, ensure_ascii=False, indent=2), encoding="utf-8")
-    try:
-        data = json.loads(p.read_text(encoding="utf-8"))
-        if "tickets" not in data or not isinstance(data["tickets"], list):
-            return {"tickets": []}
-        return data
-    except Exception:
-        return {"tickets": []}
+    return get_backend().load_tickets(gid)
+
+
+def _message_row(message):
+    """トランスクリプト1行分（Web管理画面の load_ticket_detail が読む形式）"""
+    content = message.content or ""
+    if not content and message.embeds:
+        e = message.embeds[0]
+        content = "\n".join(x for x in (e.title, e.description) if x)
+    return {
+        "ts": message.created_at.astimezone(datetime.timezone.utc).replace(microsecond=0, tzinfo=None).isoformat() + "Z",
+        "author_id": str(message.author.id),
+        "author_name": message.author.display_name,
+        "content": content,
+        "attachments": [{"url": a.url, "filename": a.filename} for a in message.attachments],
+    }
+
+
+def _index_entry(t, **extra):
+    entry = {k: t.get(k) for k in INDEX_FIELDS if t.get(k) is not None}
+    entry["ticket_id"] = str(t.get("ticket_id"))
+    if "user_id" in entry:
+        entry["user_id"] = str(entry["user_id"])
+    entry.update(extra)
+    return entry
+
+
+def _ticket_places(t):
+    """チケットに紐づくチャンネル/スレッドID（int）"""
+    out = []
+    for k in ("channel_id", "thread_id"):
+        v = t.get(k)
+        if v and str(v).isdigit():
+            out.append(int(v))
+    return out
+
+
+class GuildTickets:
+    """
+    ギルド1つ分のチケットをメモリに保持し、検索用の索引を維持する。
+    by_place: channel_id/thread_id -> ticket（on_messageの判定を1回の辞書参照にする）
+    by_user: (user_id, panel_index) -> {"open": 件数, "last_created": datetime}（_check_limits用）
+    """
+
+    OPEN_STATUSES = ("open", "pending")
+
+    def __init__(self, store):
+        self.store = store
+        self.by_id = {}
+        self.by_place = {}
+        self.by_user = {}
+        for t in store["tickets"]:
+            self._index(t)
 
+    @staticmethod
+    def _user_key(t):
+        try:
+            return int(t.get("user_id", 0)), int(t.get("panel_index", -1))
+        except (TypeError, ValueError):
+            return None
+
+    @property
+    def tickets(self):
+        return self.store["tickets"]
+
+    def _index(self, t):
+        self.by_id[t.get("ticket_id")] = t
+        for cid in _ticket_places(t):
+            self.by_place[cid] = t
 
-def save_store(gid, data):
-    p = ticket_store_path(gid)
-    p.parent.mkdir(parents=True, exist_ok=True)
-    p.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        key = self._user_key(t)
+        if key is None:
+            return
+        u = self.by_user.setdefault(key, {"open": 0, "last_created": None})
+        if t.get("status") in self.OPEN_STATUSES:
+            u["open"] += 1
+        dt = parse_iso(t.get("created_at"))
+        if dt and (u["last_created"] is None or dt > u["last_created"]):
+            u["last_created"] = dt
+
+    def _adjust_open(self, t, delta):
+        u = self.by_user.get(self._user_key(t))
+        if u is not None:
+            u["open"] = max(0, u["open"] + delta)
+
+    def set_status(self, t, status):
+        was_open = t.get("status") in self.OPEN_STATUSES
+        now_open = status in self.OPEN_STATUSES
+        t["status"] = status
+        if was_open != now_open:
+            self._adjust_open(t, 1 if now_open else -1)
+
+    def user_stats(self, uid, panel_index):
+        """(オープン中の件数, 最後に作成した日時) を返す"""
+        u = self.by_user.get((int(uid), int(panel_index)))
+        if u is None:
+            return 0, None
+        return u["open"], u["last_created"]
+
+    def unindex_places(self, t):
+        for cid in _ticket_places(t):
+            if self.by_place.get(cid) is t:
+                del self.by_place[cid]
+
+    def add(self, t):
+        self.store["tickets"].append(t)
+        self._index(t)
+
+    def remove(self, t):
+        self.unindex_places(t)
+        self.by_id.pop(t.get("ticket_id"), None)
+        # last_created は残す（削除済みでも作成した事実はクールダウンに数える）
+        if t.get("status") in self.OPEN_STATUSES:
+            self._adjust_open(t, -1)
+        try:
+            self.store["tickets"].remove(t)
+        except ValueError:
+            pass
 
+    def next_count(self, panel_index):
+        """
+        パネルごとの連番を1進めて返す（store["counters"] に保持、削除されても戻らない）。
+        未設定のパネルは既存チケット数から始める（従来の採番と連続させる）。
+        """
+        counters = self.store.setdefault("counters", {})
+        key = str(panel_index)
+        cur = counters.get(key)
+        if cur is None:
+            cur = sum(1 for t in self.tickets if int(t.get("panel_index", -1)) == int(panel_index))
+        counters[key] = int(cur) + 1
+        return counters[key]
 
-def render(s, mp):
-    s = str(s or "")
-    for k, v in mp.items():
-        s = s.replace("{" + k + "}", str(v))
-    return s
+    def find_by_place(self, cid):
+        return self.by_place.get(int(cid)) if cid is not None else None
 
 
 def color_from_hex(x, fallback=discord.Color.blurple()):
@@ -178,16 +308,141 @@ class CloseConfirmView(discord.ui.View):
 class TicketSystem(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self._guilds = {}   # gid -> GuildTickets
+        self._touched = {}  # gid -> {ticket_id}  last_message_at 未書き出し
+        self._transcripts = {}  # gid -> {ticket_id: [メッセージ]}  トランスクリプト未書き出し
+        self._transcript_lines = 0
+        self._flush_now = False  # 行数が溜まったので書き出し予定を待たずに書き出す
+        self._deadlines = DeadlineQueue()  # (gid, ticket_id) -> 自動削除の期限 / FLUSH_KEY -> 次の書き出し
+        self._sched_versions = {}  # gid -> 期限計算に使った設定バージョン
+        add_config_listener(self._on_config_change)
         self._cleanup_task = bot.loop.create_task(self._cleanup_loop())
 
     def cog_unload(self):
+        remove_config_listener(self._on_config_change)
         try:
             self._cleanup_task.cancel()
         except Exception:
             pass
+        # 終了時はループが止まっている可能性があるので同期で書き出す（1件失敗しても残りは書く）
+        for gid, rows in self._take_activity().items():
+            try:
+                get_backend().upsert_tickets(gid, rows)
+            except Exception:
+                logger.exception("ticket activity flush failed: guild=%s", gid)
+        for gid, per_ticket in self._take_transcripts().items():
+            for tid, rows in per_ticket.items():
+                try:
+                    ticket_logs.append_messages(gid, tid, rows)
+                except Exception:
+                    logger.exception("ticket transcript flush failed: guild=%s ticket=%s", gid, tid)
+
+    async def _tickets(self, gid):
+        gid = int(gid)
+        gt = self._guilds.get(gid)
+        if gt is None:
+            store = await run_io(("tickets", str(gid)), load_store, gid)
+            # 読み込み待ちの間に別タスクが先に作っていたらそちらを使う
+            gt = self._guilds.setdefault(gid, GuildTickets(store))
+        return gt
+
+    async def _save(self, gid, method, *args):
+        """チケット系の書き込みをI/Oスレッドで（同じギルドは順番に）"""
+        return await abackend(("tickets", str(gid)), method, gid, *args)
+
+    def _take_activity(self):
+        """書き出し待ちの last_message_at を gid -> [ticketのコピー] で取り出す"""
+        touched, self._touched = self._touched, {}
+        out = {}
+        for gid, ids in touched.items():
+            gt = self._guilds.get(gid)
+            if gt is None:
+                continue
+            rows = [dict(gt.by_id[i]) for i in ids if i in gt.by_id]
+            if rows:
+                out[gid] = rows
+        return out
+
+    def _schedule_flush(self):
+        """最初の未書き出しから ACTIVITY_FLUSH_INTERVAL 後に1回だけ書き出す（以降の発言はそれに相乗り）"""
+        if FLUSH_KEY not in self._deadlines:
+            self._deadlines.schedule(FLUSH_KEY, time.time() + ACTIVITY_FLUSH_INTERVAL)
+
+    def _restore_activity(self, gid, rows):
+        # 書けなかった分は次回また書く
+        self._touched.setdefault(gid, set()).update(r.get("ticket_id") for r in rows)
+        self._schedule_flush()
+
+    async def _flush_activity(self):
+        """on_message でまとめておいた last_message_at をギルド単位で一括書き出し（失敗したギルドは次回に回す）"""
+        pending = list(self._take_activity().items())
+        for i, (gid, rows) in enumerate(pending):
+            try:
+                await self._save(gid, "upsert_tickets", rows)
+            except Exception:
+                logger.exception("ticket activity flush failed: guild=%s", gid)
+                self._restore_activity(gid, rows)
+            except BaseException:
+                for g, r in pending[i:]:
+                    self._restore_activity(g, r)
+                raise
+
+    def _buffer_transcript(self, gid, tid, row):
+        self._schedule_flush()
+        self._transcripts.setdefault(gid, {}).setdefault(tid, []).append(row)
+        self._transcript_lines += 1
+        if self._transcript_lines >= TRANSCRIPT_FLUSH_LINES and not self._flush_now:
+            self._flush_now = True
+            self._deadlines.wake()
+
+    def _take_transcripts(self, gid=None, tid=None):
+        """書き出し待ちのトランスクリプトを gid -> {ticket_id: [行]} で取り出す（指定時はそのチケットだけ）"""
+        if gid is None:
+            out, self._transcripts = self._transcripts, {}
+            self._transcript_lines = 0
+            return out
+        rows = self._transcripts.get(gid, {}).pop(tid, None)
+        if not self._transcripts.get(gid, True):
+            del self._transcripts[gid]
+        if not rows:
+            return {}
+        self._transcript_lines -= len(rows)
+        return {gid: {tid: rows}}
+
+    def _restore_transcript(self, gid, tid, rows):
+        # 書けなかった分は次回また書く（その間に溜まった行より前に戻す）
+        cur = self._transcripts.setdefault(gid, {}).setdefault(tid, [])
+        cur[:0] = rows
+        self._transcript_lines += len(rows)
+        self._schedule_flush()
+
+    async def _flush_transcripts(self, gid=None, tid=None):
+        """
+        トランスクリプトを {ticket_id}.jsonl に追記（1チケット1回の書き込み、ギルド単位で順番に）。
+        失敗したチケットは次回に回し、残りのチケットはそのまま書く。
+        """
+        pending = [(g, t, rows) for g, per_ticket in self._take_transcripts(gid, tid).items()
+                   for t, rows in per_ticket.items()]
+        for i, (g, t, rows) in enumerate(pending):
+            try:
+                await run_io(("ticket_logs", str(g)), ticket_logs.append_messages, g, t, rows)
+            except Exception:
+                logger.exception("ticket transcript flush failed: guild=%s ticket=%s", g, t)
+                self._restore_transcript(g, t, rows)
+            except BaseException:
+                for g2, t2, rows2 in pending[i:]:
+                    self._restore_transcript(g2, t2, rows2)
+                raise
+
+    async def _log_index(self, gid, t, **extra):
+        """Web管理画面のチケットログ一覧に1件分の変更を追記（index.json 全体は書き換えない）"""
+        try:
+            await run_io(("ticket_logs", str(gid)), ticket_logs.upsert_index, gid, _index_entry(t, **extra))
+        except Exception:
+            logger.exception("ticket index update failed")
 
     async def deploy_panel(self, channel: discord.TextChannel, panel_index: int):
-        cfg = load_guild_config(channel.guild.id)
+        cfg = await aload_guild_config(channel.guild.id)
         panel = cfg["ticket"]["panels"][panel_index]
 
         e = discord.Embed(
@@ -204,7 +459,8 @@ class TicketSystem(commands.Cog):
         )
         btn.callback = self._create_button
         view.add_item(btn)
-        msg = await channel.send(embed=e, view=view)
+        msg = await outbound.call(self.bot, outbound.channel_route(channel), outbound.INTERACTIVE,
+                                  channel.send, embed=e, view=view)
         return msg
 
     async def _create_button(self, interaction: discord.Interaction):
@@ -215,10 +471,10 @@ class TicketSystem(commands.Cog):
             await interaction.response.send_message("ボタン情報が壊れています。", ephemeral=True)
             return
 
-        cfg = load_guild_config(interaction.guild.id)
+        cfg = await aload_guild_config(interaction.guild.id)
         panel = cfg["ticket"]["panels"][panel_index]
 
-        ok, reason = self._check_limits(interaction.guild.id, interaction.user.id, panel_index)
+        ok, reason = await self._check_limits(cfg, interaction.guild.id, interaction.user.id, panel_index)
         if not ok:
             await interaction.response.send_message(reason, ephemeral=True)
             return
@@ -259,27 +515,13 @@ class TicketSystem(commands.Cog):
         )
         await interaction.followup.send(msg, ephemeral=True)
 
-    def _check_limits(self, gid, uid, panel_index):
-        cfg = load_guild_config(gid)
+    async def _check_limits(self, cfg, gid, uid, panel_index):
         panel = cfg["ticket"]["panels"][panel_index]
         lim = panel.get("limits", {}) or {}
         max_open = int(lim.get("max_open_per_user", 5))
         cooldown = int(lim.get("cooldown_minutes", 30))
 
-        store = load_store(gid)
-        open_count = 0
-        last_created = None
-
-        for t in store["tickets"]:
-            if int(t.get("user_id", 0)) != int(uid):
-                continue
-            if int(t.get("panel_index", -1)) != int(panel_index):
-                continue
-            if t.get("status") in ("open", "pending"):
-                open_count += 1
-            dt = parse_iso(t.get("created_at"))
-            if dt and (last_created is None or dt > last_created):
-                last_created = dt
+        open_count, last_created = (await self._tickets(gid)).user_stats(uid, panel_index)
 
         if open_count >= max_open:
             return False, f"同時に持てるチケット数の上限（{max_open}件）に達しています。"
@@ -294,7 +536,7 @@ class TicketSystem(commands.Cog):
 
     async def create_ticket(self, interaction: discord.Interaction, panel_index: int, ticket_type: str, urgency: str, body: str, image_url: str):
         guild = interaction.guild
-        cfg = load_guild_config(guild.id)
+        cfg = await aload_guild_config(guild.id)
         panel = cfg["ticket"]["panels"][panel_index]
 
         types = panel.get("types", []) or []
@@ -307,8 +549,10 @@ class TicketSystem(commands.Cog):
         if urgency not in choices:
             urgency = choices[0] if choices else "低い"
 
-        store = load_store(guild.id)
-        count = 1 + sum(1 for t in store["tickets"] if int(t.get("panel_index", -1)) == panel_index)
+        gt = await self._tickets(guild.id)
+        # 採番はチャンネル作成前に確定・保存しておく（失敗しても番号は再利用しない）
+        count = gt.next_count(panel_index)
+        await self._save(guild.id, "set_ticket_counter", panel_index, count)
 
         mapping = {
             "user": interaction.user.name,
@@ -342,10 +586,12 @@ class TicketSystem(commands.Cog):
                 return False, "スレッド親チャンネルが不正です。"
 
             name = render(panel.get("name_template", "ticket-{count}-{user}"), mapping)[:90]
-            thread = await parent.create_thread(name=name, type=discord.ChannelType.private_thread)
+            thread = await outbound.call(self.bot, outbound.channel_route(parent), outbound.INTERACTIVE,
+                                         parent.create_thread, name=name, type=discord.ChannelType.private_thread)
             created_thread_id = thread.id
 
-            await thread.add_user(interaction.user)
+            await outbound.call(self.bot, outbound.channel_route(thread), outbound.INTERACTIVE,
+                                thread.add_user, interaction.user)
             # staffはロールメンバーが多すぎると重いので最小限（運用で必要なら後で改善）
             target = thread
 
@@ -356,7 +602,9 @@ class TicketSystem(commands.Cog):
                 category = None
 
             name = render(panel.get("name_template", "ticket-{count}-{user}"), mapping).lower().replace(" ", "-")[:90]
-            ch = await guild.create_text_channel(name=name, category=category, overwrites=overwrites, reason="ticket create")
+            ch = await outbound.call(self.bot, outbound.guild_route(guild), outbound.INTERACTIVE,
+                                     guild.create_text_channel, name=name, category=category,
+                                     overwrites=overwrites, reason="ticket create")
             created_channel_id = ch.id
             target = ch
 
@@ -401,15 +649,18 @@ class TicketSystem(commands.Cog):
                 inline=inline
             )
 
-            await target.send(embed=e, view=self._ticket_control_view(guild.id, panel_index))
+            await outbound.call(self.bot, outbound.channel_route(target), outbound.INTERACTIVE,
+                                target.send, embed=e, view=self._ticket_control_view(guild.id, panel_index))
         else:
             # post無効なら最低限
-            await target.send("チケットを作成しました。", view=self._ticket_control_view(guild.id, panel_index))
+            await outbound.call(self.bot, outbound.channel_route(target), outbound.INTERACTIVE,
+                                target.send, "チケットを作成しました。", view=self._ticket_control_view(guild.id, panel_index))
 
         ticket_id = f"{guild.id}-{panel_index}-{int(datetime.datetime.utcnow().timestamp()*1000)}"
-        store["tickets"].append({
+        ticket = {
             "ticket_id": ticket_id,
             "panel_index": panel_index,
+            "count": count,
             "user_id": interaction.user.id,
             "status": "open",
             "type": ticket_type,
@@ -418,8 +669,20 @@ class TicketSystem(commands.Cog):
             "last_message_at": now_iso(),
             "channel_id": created_channel_id,
             "thread_id": created_thread_id
+        }
+        gt.add(ticket)
+        await self._save(guild.id, "upsert_ticket", dict(ticket))
+        self._schedule_ticket(guild.id, ticket, cfg)
+
+        # トランスクリプトの先頭は作成時の入力内容
+        await self._log_index(guild.id, ticket, title="{} #{} {}".format(panel.get("panel_name", "Ticket"), count, ticket_type))
+        self._buffer_transcript(guild.id, ticket_id, {
+            "ts": ticket["created_at"],
+            "author_id": str(interaction.user.id),
+            "author_name": interaction.user.display_name,
+            "content": body,
+            "attachments": [{"url": image_url.strip(), "filename": "参考画像"}] if image_url and image_url.strip() else [],
         })
-        save_store(guild.id, store)
 
         return True, f"チケットを作成しました：{target.mention}"
 
@@ -435,7 +698,7 @@ class TicketSystem(commands.Cog):
 
     async def _close_button(self, interaction: discord.Interaction):
         gid = interaction.guild.id
-        cfg = load_guild_config(gid)
+        cfg = await aload_guild_config(gid)
 
         try:
             _, _, pidx = (interaction.data.get("custom_id") or "").split(":")
@@ -445,8 +708,7 @@ class TicketSystem(commands.Cog):
             return
 
         panel = cfg["ticket"]["panels"][panel_index]
-        store = load_store(gid)
-        ticket = self._find_ticket_by_context(store, interaction.channel)
+        ticket = await self._find_ticket_by_context(gid, interaction.channel)
 
         if not ticket:
             await interaction.response.send_message("この場所はチケットとして登録されていません。", ephemeral=True)
@@ -466,15 +728,10 @@ class TicketSystem(commands.Cog):
         await interaction.followup.send(msg, ephemeral=True)
 
     async def close_ticket_by_id(self, guild, ticket_id, panel_index):
-        cfg = load_guild_config(guild.id)
+        cfg = await aload_guild_config(guild.id)
         panel = cfg["ticket"]["panels"][panel_index]
-        store = load_store(guild.id)
-
-        t = None
-        for x in store["tickets"]:
-            if x.get("ticket_id") == ticket_id:
-                t = x
-                break
+        gt = await self._tickets(guild.id)
+        t = gt.by_id.get(ticket_id)
         if not t:
             return False, "チケットが見つかりません。"
 
@@ -485,9 +742,13 @@ class TicketSystem(commands.Cog):
         if ch is None and t.get("thread_id"):
             ch = guild.get_thread(int(t["thread_id"])) if hasattr(guild, "get_thread") else None
 
-        t["status"] = "closed"
+        gt.set_status(t, "closed")
         t["closed_at"] = now_iso()
-        save_store(guild.id, store)
+        await self._save(guild.id, "upsert_ticket", dict(t))
+        self._schedule_ticket(guild.id, t, cfg)
+        # クローズ時点までのトランスクリプトを書き切ってから一覧を更新する
+        await self._flush_transcripts(guild.id, ticket_id)
+        await self._log_index(guild.id, t)
 
         if ch is None:
             return True, "クローズしました（対象が見つからないため記録のみ更新）。"
@@ -499,85 +760,135 @@ class TicketSystem(commands.Cog):
             cat = guild.get_channel(int(closed_cat))
             if isinstance(cat, discord.CategoryChannel):
                 try:
-                    await ch.edit(category=cat, reason="ticket closed")
+                    await outbound.call(self.bot, outbound.channel_route(ch), outbound.INTERACTIVE,
+                                        ch.edit, category=cat, reason="ticket closed")
                     return True, "クローズしました（閉鎖カテゴリへ移動）。"
                 except Exception:
                     logger.exception("failed to move closed ticket")
 
         try:
-            await ch.delete(reason="ticket closed")
+            await outbound.call(self.bot, outbound.channel_route(ch), outbound.INTERACTIVE,
+                                ch.delete, reason="ticket closed")
+            gt.unindex_places(t)
             return True, "クローズしました（削除）。"
         except Exception:
             logger.exception("failed to delete closed ticket")
             return True, "クローズしました（削除に失敗：権限を確認してください）。"
 
-    def _find_ticket_by_context(self, store, channel_obj):
-        cid = getattr(channel_obj, "id", None)
-        if cid is None:
-            return None
-        for t in store["tickets"]:
-            if t.get("channel_id") and int(t["channel_id"]) == int(cid):
-                return t
-            if t.get("thread_id") and int(t["thread_id"]) == int(cid):
-                return t
-        return None
+    async def _find_ticket_by_context(self, gid, channel_obj):
+        return (await self._tickets(gid)).find_by_place(getattr(channel_obj, "id", None))
 
     @commands.Cog.listener()
     async def on_message(self, message):
-        if not message.guild or message.author.bot:
+        if not message.guild:
             return
-        store = load_store(message.guild.id)
-        t = self._find_ticket_by_context(store, message.channel)
+        t = await self._find_ticket_by_context(message.guild.id, message.channel)
         if not t:
             return
+        # トランスクリプトはBotの発言も含めて記録（書き出しはまとめて）
+        self._buffer_transcript(message.guild.id, t.get("ticket_id"), _message_row(message))
+        if message.author.bot:
+            return
+        # ✅ 書き込みはまとめて後で（_cleanup_loop / cog_unload）
+        # 期限は延びるだけなので再登録はしない（期限到来時に再計算して延長する）
         t["last_message_at"] = now_iso()
-        save_store(message.guild.id, store)
+        self._schedule_flush()
+        self._touched.setdefault(message.guild.id, set()).add(t.get("ticket_id"))
+
+    # -------------------------
+    # auto delete scheduler
+    # -------------------------
+    def _on_config_change(self, gid):
+        # 期限の設定が変わったかもしれないので、ループ側で再計算させる
+        self._deadlines.wake()
+
+    def _deadline_for(self, cfg, t):
+        """チケットの自動削除期限（epoch秒）。対象外なら None"""
+        panels = cfg.get("ticket", {}).get("panels", [])
+        panel_index = int(t.get("panel_index", 0))
+        if panel_index < 0 or panel_index >= len(panels):
+            return None
+        panel = panels[panel_index]
+
+        # inactive auto delete
+        if t.get("status") in GuildTickets.OPEN_STATUSES:
+            ad = panel.get("auto_delete", {}) or {}
+            mins = int(ad.get("inactive_minutes", 0))
+            lm = iso_to_ts(t.get("last_message_at"))
+            if ad.get("enabled", False) and mins > 0 and lm:
+                return lm + mins * 60
+            return None
+
+        # delete closed after N days
+        if t.get("status") == "closed":
+            days = int(panel.get("close", {}).get("delete_after_days", 14))
+            ca = iso_to_ts(t.get("closed_at"))
+            if ca:
+                return ca + days * 86400
+        return None
+
+    def _schedule_ticket(self, gid, t, cfg):
+        key = (int(gid), t.get("ticket_id"))
+        deadline = self._deadline_for(cfg, t)
+        if deadline is None:
+            self._deadlines.cancel(key)
+        else:
+            self._deadlines.schedule(key, deadline)
+
+    async def _schedule_guild(self, gid):
+        cfg = await aload_guild_config(gid)
+        self._sched_versions[int(gid)] = guild_config_version(gid)
+        for t in (await self._tickets(gid)).tickets:
+            self._schedule_ticket(gid, t, cfg)
 
     async def _cleanup_loop(self):
         await self.bot.wait_until_ready()
         while not self.bot.is_closed():
             try:
+                due = self._deadlines.pop_due()
+                if FLUSH_KEY in due or self._flush_now:
+                    self._flush_now = False
+                    self._deadlines.cancel(FLUSH_KEY)
+                    await self._flush_activity()
+                    await self._flush_transcripts()
+                # 初回 + 設定が変わったギルドだけ期限を再計算（ディスクI/Oなし）
                 for g in list(self.bot.guilds):
-                    await self._cleanup_guild(g)
+                    if self._sched_versions.get(g.id) != guild_config_version(g.id):
+                        await self._schedule_guild(g.id)
+                for key in due:
+                    if key != FLUSH_KEY:
+                        await self._expire_ticket(*key)
             except Exception:
                 logger.exception("cleanup loop error")
-            await asyncio.sleep(60)
-
-    async def _cleanup_guild(self, guild):
-        cfg = load_guild_config(guild.id)
-        store = load_store(guild.id)
-        changed = False
-        now = datetime.datetime.utcnow()
-
-        for t in list(store["tickets"]):
-            panel_index = int(t.get("panel_index", 0))
-            panels = cfg.get("ticket", {}).get("panels", [])
-            if panel_index < 0 or panel_index >= len(panels):
-                continue
-            panel = panels[panel_index]
+            await self._deadlines.wait()
 
-            # inactive auto delete
-            ad = panel.get("auto_delete", {}) or {}
-            if ad.get("enabled", False) and t.get("status") in ("open", "pending"):
-                mins = int(ad.get("inactive_minutes", 0))
-                lm = parse_iso(t.get("last_message_at"))
-                if mins > 0 and lm and (now - lm).total_seconds() > mins * 60:
-                    await self._delete_if_exists(guild, t)
-                    store["tickets"].remove(t)
-                    changed = True
-                    continue
-
-            # delete closed after N days
-            if t.get("status") == "closed":
-                days = int(panel.get("close", {}).get("delete_after_days", 14))
-                ca = parse_iso(t.get("closed_at"))
-                if ca and (now - ca).days >= days:
-                    await self._delete_if_exists(guild, t)
-                    store["tickets"].remove(t)
-                    changed = True
-
-        if changed:
-            save_store(guild.id, store)
+    async def _expire_ticket(self, gid, tid):
+        guild = self.bot.get_guild(gid)
+        if guild is None:
+            return
+        gt = await self._tickets(gid)
+        t = gt.by_id.get(tid)
+        if not t:
+            return
+
+        # 期限到来時点の状態で再計算（発言があれば延長される）
+        deadline = self._deadline_for(await aload_guild_config(gid), t)
+        if deadline is None:
+            return
+        if deadline > time.time():
+            self._deadlines.schedule((gid, tid), deadline)
+            return
+
+        await self._flush_transcripts(gid, tid)
+        if t.get("status") in GuildTickets.OPEN_STATUSES:
+            # 放置で削除されたチケットはログ上はクローズ扱い
+            await self._log_index(gid, t, status="closed", closed_at=now_iso())
+        await self._delete_if_exists(guild, t)
+        gt.remove(t)
+        touched = self._touched.get(gid)
+        if touched:
+            touched.discard(tid)
+        await self._save(gid, "delete_tickets", [tid])
 
     async def _delete_if_exists(self, guild, t):
         ch = None
@@ -587,7 +898,8 @@ class TicketSystem(commands.Cog):
             ch = guild.get_thread(int(t["thread_id"])) if hasattr(guild, "get_thread") else None
         if ch:
             try:
-                await ch.delete(reason="ticket cleanup")
+                await outbound.call(self.bot, outbound.channel_route(ch), outbound.BACKGROUND,
+                                    ch.delete, reason="ticket cleanup")
             except Exception:
                 logger.exception("cleanup delete failed")
 
@@ -1,5 +1,5 @@
+import asyncio
 import logging
-import json
 import datetime
 from pathlib import Path
 
@@ -10,109 +10,23 @@ from aiohttp import web
 import aiohttp_jinja2
 import jinja2
 
+from utils import member_names, outbound, ticket_export, ticket_logs, transcript
+from utils.storage import (
+    aload_guild_config,
+    asave_guild_config,
+    aupdate_guild_config,
+    deep_merge,
+    default_ticket_panel,
+    get_backend,
+    run_io,
+)
+
 logger = logging.getLogger("WebManager")
 
 
 # -------------------------
 # helpers
 # -------------------------
-def deep_merge(dst, src):
-    """dst に src を再帰マージ（dst優先で不足を埋める）"""
-    if not isinstance(dst, dict) or not isinstance(src, dict):
-        return dst
-    for k, v in src.items():
-        if k not in dst:
-            dst[k] = v
-        else:
-            if isinstance(dst[k], dict) and isinstance(v, dict):
-                deep_merge(dst[k], v)
-    return dst
-
-
-def default_config():
-    return {
-        "lang": "ja",
-        "jl": {
-            "enabled": False,
-            "channels": {"join": "", "leave": ""},
-            "filters": {"ignore_bots": True},
-            "join_embed": {
-                "title": "Welcome!",
-                "description": "{user} が参加しました",
-                "color": "#5865F2",
-                "footer": ""
-            },
-            "leave_embed": {
-                "title": "Bye!",
-                "description": "{user} が退出しました",
-                "color": "#ED4245",
-                "footer": ""
-            }
-        },
-        "ticket": {
-            "enabled": True,
-            "panels": []
-        },
-        "rank": {
-            "enabled": True,
-            "embed": {
-                "title": "ランク - {username}",
-                "description": "レベル\n{level}\nXP\n{xp}/{next}\nメッセージ\n{messages}",
-                "color": "#6D7CFF",
-                "fields": [],
-                "footer": {"text": "Ranking"}
-            },
-            "leaderboard": {
-                "enabled": False,
-                "channel_id": "",
-                "message_id": "",
-                "interval_minutes": 10,
-                # ✅ 追加要件
-                "mention": False,
-                "show": {"text": True, "vc": True, "overall": True}
-            }
-        }
-    }
-
-
-def default_ticket_panel():
-    return {
-        "panel_name": "default",
-        "enabled": True,
-        "deploy": {"channel_id": "", "message_id": ""},
-
-        "mode": "channel",  # channel / thread
-        "parent_category_id": "",
-        "thread_parent_channel_id": "",
-        "name_template": "ticket-{count}-{user}",
-        "types": ["質問", "不具合", "申請", "通報"],
-
-        "limits": {"max_open_per_user": 5, "cooldown_minutes": 30},
-
-        "permissions": {"staff_role_ids": [], "viewer_role_ids": []},
-
-        "form": {"enabled": False, "fields": []},
-
-        "rules": {
-            "enabled": False,
-            "title": "📌ルール・注意事項",
-            "body": "",
-            "allow_everyone_mention": False,
-            "allowed_role_ids": [],
-            "policy": "staff_only"
-        },
-
-        "close": {
-            "confirm_required": True,
-            "closed_category_id": "",
-            "allow_reopen": True,
-            "delete_after_days": 14
-        },
-
-        "auto_delete": {"enabled": False, "inactive_minutes": 0}
-    }
-
-
 def _safe_int(val, default=0):
     try:
         return int(val)
@@ -170,6 +84,7 @@ class WebManager(commands.Cog):
 
         # ticket logs pages
         r.add_get("/guild/{gid}/tickets", self.handle_ticket_logs)
+        r.add_get("/guild/{gid}/tickets/export", self.handle_ticket_export)  # {tid} より先に
         r.add_get("/guild/{gid}/tickets/{tid}", self.handle_ticket_view)
         r.add_get("/guild/{gid}/tickets/{tid}/download", self.handle_ticket_download)
 
@@ -198,87 +113,27 @@ class WebManager(commands.Cog):
     # -------------------------
     # config storage
     # -------------------------
-    def cfg_path(self, gid):
-        return Path("settings/guilds/{}/config.json".format(gid))
+    # Bot側と同じ utils.storage の設定キャッシュを使う（スキーマも共通。GETではファイルに書き込まない）
+    async def aget_guild_cfg(self, gid):
+        """表示用の共有スナップショット（コピーしないので変更しないこと）"""
+        return await aload_guild_config(gid, readonly=True)
 
-    def get_guild_cfg(self, gid):
-        p = self.cfg_path(gid)
-        base = default_config()
+    async def asave_guild_cfg(self, gid, cfg):
+        await asave_guild_config(gid, cfg)
 
-        if not p.exists():
-            p.parent.mkdir(parents=True, exist_ok=True)
-            cfg = base
-            if not cfg["ticket"]["panels"]:
-                cfg["ticket"]["panels"] = [default_ticket_panel()]
-            p.write_text(json.dumps(cfg, ensure_ascii=False, indent=2), encoding="utf-8")
-            return cfg
-
-        try:
-            data = json.loads(p.read_text(encoding="utf-8") or "{}")
-        except Exception:
-            data = {}
-
-        deep_merge(data, base)
-
-        # ticket panels ensure
-        if not data.get("ticket", {}).get("panels"):
-            data["ticket"]["panels"] = [default_ticket_panel()]
-        else:
-            bp = default_ticket_panel()
-            for i in range(len(data["ticket"]["panels"])):
-                if not isinstance(data["ticket"]["panels"][i], dict):
-                    data["ticket"]["panels"][i] = {}
-                deep_merge(data["ticket"]["panels"][i], bp)
-
-        # rank leaderboard ensure
-        data.setdefault("rank", {})
-        data["rank"].setdefault("leaderboard", {})
-        deep_merge(data["rank"]["leaderboard"], base["rank"]["leaderboard"])
-
-        p.parent.mkdir(parents=True, exist_ok=True)
-        p.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-        return data
-
-    def save_guild_cfg(self, gid, cfg):
-        p = self.cfg_path(gid)
-        p.parent.mkdir(parents=True, exist_ok=True)
-        p.write_text(json.dumps(cfg, ensure_ascii=False, indent=2), encoding="utf-8")
+    async def aupdate_guild_cfg(self, gid, fn):
+        """読み込み→fn(cfg)→保存 をロック内で（fn はI/Oスレッドで呼ばれるので同期処理にすること）"""
+        return await aupdate_guild_config(gid, fn)
 
     # -------------------------
     # ticket logs storage (read-only in web)
     # -------------------------
-    def ticket_dir(self, gid):
-        d = Path("data/tickets/{}".format(gid))
-        d.mkdir(parents=True, exist_ok=True)
-        return d
-
-    def ticket_index_path(self, gid):
-        return self.ticket_dir(gid) / "index.json"
-
-    def load_ticket_index(self, gid):
-        p = self.ticket_index_path(gid)
-        if not p.exists():
-            p.write_text("[]", encoding="utf-8")
-        try:
-            raw = p.read_text(encoding="utf-8").strip()
-            data = json.loads(raw) if raw else []
-            if not isinstance(data, list):
-                return []
-            return data
-        except Exception:
-            return []
+    async def aload_ticket_index(self, gid):
+        """整列済みの TicketIndex（追記された分だけ反映し、まとめ直した時だけ全体を読み直す）"""
+        return await run_io(("ticket_logs", str(gid)), ticket_logs.load_index, gid)
 
-    def load_ticket_detail(self, gid, tid):
-        p = self.ticket_dir(gid) / "{}.json".format(tid)
-        if not p.exists():
-            return None
-        try:
-            data = json.loads(p.read_text(encoding="utf-8") or "{}")
-            if not isinstance(data, dict):
-                return None
-            return data
-        except Exception:
-            return None
+    async def aload_ticket_detail(self, gid, tid):
+        return await run_io(("ticket_logs", str(gid)), ticket_logs.load_detail, gid, tid)
 
     # -------------------------
     # pages
@@ -306,15 +161,16 @@ class WebManager(commands.Cog):
     async def handle_guild_dashboard(self, request):
         gid = request.match_info["gid"]
         guild = self.bot.get_guild(int(gid))
-        cfg = self.get_guild_cfg(gid)
+        cfg = await self.aget_guild_cfg(gid)
 
-        stats_path = Path("data/stats/{}.json".format(gid))
-        raw = {}
-        if stats_path.exists():
-            try:
-                raw = json.loads(stats_path.read_text(encoding="utf-8"))
-            except Exception:
-                raw = {}
+        try:
+            raw = await run_io(("stats",), get_backend().load_stats, gid)
+        except Exception:
+            logger.exception("failed to load stats")
+            raw = {}
+        # 未書き出しの集計分も反映
+        if getattr(self.bot, "stats", None) is not None:
+            raw = self.bot.stats.overlay(gid, raw)
 
         dates = [(datetime.date.today() - datetime.timedelta(days=i)).isoformat() for i in range(6, -1, -1)]
         msg_counts = [int(raw.get(d, {}).get("messages", 0)) for d in dates]
@@ -329,7 +185,7 @@ class WebManager(commands.Cog):
     async def handle_jl_settings(self, request):
         gid = request.match_info["gid"]
         guild = self.bot.get_guild(int(gid))
-        cfg = self.get_guild_cfg(gid)
+        cfg = await self.aget_guild_cfg(gid)
 
         channels = [{"id": str(c.id), "name": c.name} for c in guild.text_channels] if guild else []
         return aiohttp_jinja2.render_template("settings_join_leave.html", request, {
@@ -341,7 +197,7 @@ class WebManager(commands.Cog):
     async def handle_ticket_settings(self, request):
         gid = request.match_info["gid"]
         guild = self.bot.get_guild(int(gid))
-        cfg = self.get_guild_cfg(gid)
+        cfg = await self.aget_guild_cfg(gid)
 
         tab = (request.query.get("tab") or "form").strip().lower()
         if tab not in ("form", "rules"):
@@ -373,7 +229,7 @@ class WebManager(commands.Cog):
     async def handle_rank_settings(self, request):
         gid = request.match_info["gid"]
         guild = self.bot.get_guild(int(gid))
-        cfg = self.get_guild_cfg(gid)
+        cfg = await self.aget_guild_cfg(gid)
 
         channels = [{"id": str(c.id), "name": c.name} for c in guild.text_channels] if guild else []
         return aiohttp_jinja2.render_template("settings_ranking.html", request, {
@@ -385,125 +241,67 @@ class WebManager(commands.Cog):
     async def handle_ticket_logs(self, request):
         gid = request.match_info["gid"]
         guild = self.bot.get_guild(int(gid))
-        cfg = self.get_guild_cfg(gid)
+        cfg = await self.aget_guild_cfg(gid)
 
-        items = self.load_ticket_index(gid)
-        # 新しい順
-        def _key(x):
-            return str(x.get("created_at", ""))
-        items = sorted(items, key=_key, reverse=True)
+        index = await self.aload_ticket_index(gid)
+
+        q = request.query
+        filters = {k: q.get(k, "").strip() for k in ("status", "panel", "user", "urgency", "since", "until")}
+        items, next_cursor = index.page(
+            cursor=q.get("cursor", ""),
+            limit=_safe_int(q.get("limit"), ticket_logs.PAGE_SIZE),
+            **filters
+        )
+
+        # 作成者の表示名（このページの分だけまとめて解決、見つからなければIDのまま）
+        names = {}
+        if guild:
+            names = await member_names.resolve(self.bot, guild, [x.get("user_id") for x in items if x.get("user_id")])
 
         return aiohttp_jinja2.render_template("ticket_logs.html", request, {
             "guild": guild,
             "cfg": cfg,
-            "tickets": items
+            "tickets": items,
+            "total": len(index),
+            "filters": filters,
+            "next_cursor": next_cursor,
+            "export_max": ticket_export.EXPORT_MAX_TICKETS,
+            "panels": cfg.get("ticket", {}).get("panels", []),
+            "names": names
         })
 
-    def _ticket_to_html(self, guild, ticket, detail):
+    def _author_names(self, guild):
         """
-        detail想定:
-        {
-          "ticket_id": "...",
-          "created_at": "...",
-          "status": "open/pending/closed/locked",
-          "title": "...",
-          "messages": [
-             {"ts":"...", "author_name":"...", "author_id":"...", "content":"...", "attachments":[{"url":"...","filename":"..."}]}
-          ]
-        }
+        author_name が無いメッセージ用に author_id から表示名を引く関数（transcript.iter_html に渡す）。
+        描画はI/Oスレッドで行い、名前の解決だけイベントループ上で行う。
         """
-        gname = guild.name if guild else "Guild"
-        title = (detail or {}).get("title") or (ticket or {}).get("title") or "Ticket"
-        tid = (detail or {}).get("ticket_id") or (ticket or {}).get("ticket_id") or "unknown"
-        status = (detail or {}).get("status") or (ticket or {}).get("status") or "unknown"
-        created = (detail or {}).get("created_at") or (ticket or {}).get("created_at") or ""
-        msgs = (detail or {}).get("messages") or []
-
-        def esc(s):
-            s = "" if s is None else str(s)
-            return (s.replace("&", "&amp;")
-                     .replace("<", "&lt;")
-                     .replace(">", "&gt;")
-                     .replace('"', "&quot;"))
-
-        rows = []
-        for m in msgs:
-            ts = esc(m.get("ts", ""))
-            an = esc(m.get("author_name", ""))
-            content = esc(m.get("content", ""))
-            atts = m.get("attachments") or []
-            att_html = ""
-            if atts:
-                links = []
-                for a in atts:
-                    url = esc(a.get("url", ""))
-                    fn = esc(a.get("filename", url))
-                    if url:
-                        links.append(f'<a href="{url}" target="_blank" rel="noopener">{fn}</a>')
-                if links:
-                    att_html = '<div class="att">📎 ' + " / ".join(links) + "</div>"
-            rows.append(f"""
-            <div class="msg">
-              <div class="meta"><span class="author">{an}</span><span class="ts">{ts}</span></div>
-              <pre class="body">{content}</pre>
-              {att_html}
-            </div>
-            """)
-
-        body = "\n".join(rows) if rows else '<div class="empty">（メッセージなし）</div>'
-
-        html = f"""<!doctype html>
-<html lang="ja">
-<head>
-<meta charset="utf-8">
-<meta name="viewport" content="width=device-width,initial-scale=1">
-<title>[{gname}] Ticket {tid}</title>
-<style>
-  body{{margin:0;background:#0f1117;color:#e6e6e6;font-family:system-ui,-apple-system,Segoe UI,Roboto,Helvetica,Arial}}
-  .wrap{{max-width:980px;margin:0 auto;padding:24px}}
-  .card{{background:rgba(255,255,255,.04);border:1px solid rgba(255,255,255,.08);border-radius:16px;padding:18px}}
-  .h{{display:flex;gap:14px;flex-wrap:wrap;align-items:center;justify-content:space-between}}
-  .title{{font-size:18px;font-weight:800}}
-  .tag{{font-size:12px;padding:6px 10px;border-radius:999px;background:rgba(88,101,242,.16);border:1px solid rgba(88,101,242,.35)}}
-  .sub{{opacity:.8;font-size:12px;margin-top:6px}}
-  .msg{{margin-top:14px;padding:12px;border-radius:14px;background:rgba(0,0,0,.25);border:1px solid rgba(255,255,255,.06)}}
-  .meta{{display:flex;justify-content:space-between;gap:10px;align-items:center;margin-bottom:8px}}
-  .author{{font-weight:700}}
-  .ts{{opacity:.7;font-size:12px}}
-  pre.body{{margin:0;white-space:pre-wrap;word-break:break-word;font-family:ui-monospace,SFMono-Regular,Menlo,Monaco,Consolas,"Liberation Mono","Courier New",monospace;font-size:13px;line-height:1.55}}
-  .att{{margin-top:10px;font-size:12px;opacity:.9}}
-  a{{color:#8ea6ff}}
-  .empty{{opacity:.8;padding:14px}}
-</style>
-</head>
-<body>
-  <div class="wrap">
-    <div class="card">
-      <div class="h">
-        <div>
-          <div class="title">{esc(title)}</div>
-          <div class="sub">Ticket ID: {esc(tid)} / Created: {esc(created)}</div>
-        </div>
-        <div class="tag">status: {esc(status)}</div>
-      </div>
-      {body}
-    </div>
-  </div>
-</body>
-</html>"""
-        return html
+        if not guild:
+            return None
+        loop = asyncio.get_running_loop()
+
+        def fn(ids):
+            return asyncio.run_coroutine_threadsafe(
+                member_names.resolve(self.bot, guild, ids), loop).result(timeout=60)
+        return fn
+
+    def _write_transcript(self, gid, tid, guild_name, ticket, detail, names):
+        """描画済みHTML（と .gz）を書く。I/Oスレッドで呼ぶ。先に他のリクエストが書いていれば何もしない"""
+        path = ticket_logs.rendered_path(gid, tid)
+        if not ticket_logs.rendered_is_fresh(gid, tid):
+            transcript.write_cached(path, transcript.iter_html(guild_name, ticket, detail, names))
+        return path
 
     async def handle_ticket_view(self, request):
         gid = request.match_info["gid"]
         tid = request.match_info["tid"]
         guild = self.bot.get_guild(int(gid))
-        cfg = self.get_guild_cfg(gid)
+        cfg = await self.aget_guild_cfg(gid)
 
-        index = self.load_ticket_index(gid)
-        ticket = next((x for x in index if str(x.get("ticket_id", "")) == str(tid)), None)
-        detail = self.load_ticket_detail(gid, tid)
+        ticket = (await self.aload_ticket_index(gid)).get(tid)
+        detail = await self.aload_ticket_detail(gid, tid)
 
-        html = self._ticket_to_html(guild, ticket, detail)
+        html = await run_io(("transcript", str(gid), str(tid)), transcript.render_html,
+                            guild.name if guild else None, ticket, detail, self._author_names(guild))
         return aiohttp_jinja2.render_template("ticket_view.html", request, {
             "guild": guild,
             "cfg": cfg,
@@ -516,20 +314,74 @@ class WebManager(commands.Cog):
         tid = request.match_info["tid"]
         guild = self.bot.get_guild(int(gid))
 
-        index = self.load_ticket_index(gid)
-        ticket = next((x for x in index if str(x.get("ticket_id", "")) == str(tid)), None)
-        detail = self.load_ticket_detail(gid, tid)
+        if ticket_logs.detail_path(gid, tid) is None:
+            raise web.HTTPNotFound()
+        ticket = (await self.aload_ticket_index(gid)).get(tid)
+        gname = guild.name if guild else None
+        headers = {
+            "Content-Type": "text/html; charset=utf-8",
+            "Content-Disposition": 'attachment; filename="ticket_{}.html"'.format(tid)
+        }
+
+        # クローズ済みは内容が変わらないので1回だけ描画してディスクから返す
+        # （ETag / Last-Modified / Range / 事前圧縮した .gz は FileResponse が処理する）
+        key = ("transcript", str(gid), str(tid))
+        if (ticket or {}).get("status") == "closed":
+            if not await run_io(key, ticket_logs.rendered_is_fresh, gid, tid):
+                detail = await self.aload_ticket_detail(gid, tid)
+                await run_io(key, self._write_transcript, gid, tid, gname, ticket, detail,
+                             self._author_names(guild))
+            return web.FileResponse(ticket_logs.rendered_path(gid, tid), headers=headers)
+
+        # 進行中のチケットは毎回描画して、できた分から送る（全文をメモリに持たない）
+        # .jsonl の読み込みと描画はI/Oスレッドでチャンク単位に進める
+        detail = await self.aload_ticket_detail(gid, tid)
+        chunks = transcript.iter_bytes(transcript.iter_html(gname, ticket, detail, self._author_names(guild)))
+        resp = web.StreamResponse(headers=headers)
+        if request.query.get("gzip", "1") != "0":
+            resp.enable_compression()  # Accept-Encoding を見て gzip/deflate
+        resp.enable_chunked_encoding()
+        await resp.prepare(request)
+        while True:
+            chunk = await run_io(key, next, chunks, None)
+            if chunk is None:
+                break
+            await resp.write(chunk)
+        await resp.write_eof()
+        return resp
+
+    async def handle_ticket_export(self, request):
+        """絞り込み条件に合うチケットのトランスクリプト＋マニフェストを zip / tar.gz でまとめてDL"""
+        gid = request.match_info["gid"]
+        guild = self.bot.get_guild(int(gid))
+
+        q = request.query
+        fmt = q.get("format", "zip")
+        if fmt not in ticket_export.FORMATS:
+            return web.json_response({"status": "ng", "error": "format must be zip or tar.gz"}, status=400)
+        filters = {k: q.get(k, "").strip() for k in ("status", "panel", "user", "urgency", "since", "until")}
+
+        index = await self.aload_ticket_index(gid)
+        entries = index.select(ticket_export.EXPORT_MAX_TICKETS, **filters)
+        if not entries:
+            return web.json_response({"status": "ng", "error": "no tickets"}, status=404)
+
+        content_type, ext = ticket_export.FORMATS[fmt]
+        filename = "tickets_{}_{}{}".format(gid, datetime.datetime.utcnow().strftime("%Y%m%d-%H%M"), ext)
+        resp = web.StreamResponse(headers={
+            "Content-Type": content_type,
+            "Content-Disposition": 'attachment; filename="{}"'.format(filename)
+        })
+        resp.enable_chunked_encoding()
+        await resp.prepare(request)
 
-        html = self._ticket_to_html(guild, ticket, detail)
-        filename = "ticket_{}.html".format(tid)
+        async def _names(ids):
+            return await member_names.resolve(self.bot, guild, ids)
 
-        return web.Response(
-            body=html.encode("utf-8"),
-            headers={
-                "Content-Type": "text/html; charset=utf-8",
-                "Content-Disposition": 'attachment; filename="{}"'.format(filename)
-            }
-        )
+        await ticket_export.stream(resp.write, fmt, gid, guild.name if guild else None, entries,
+                                   _names if guild else None)
+        await resp.write_eof()
+        return resp
 
     # -------------------------
     # APIs
@@ -541,67 +393,58 @@ class WebManager(commands.Cog):
         except Exception:
             return web.json_response({"status": "ng", "error": "invalid json"}, status=400)
 
-        deep_merge(data, default_config())
+        if not isinstance(data, dict):
+            return web.json_response({"status": "ng", "error": "config must be object"}, status=400)
 
-        # ensure ticket panels exist
-        if not data.get("ticket", {}).get("panels"):
-            data["ticket"]["panels"] = [default_ticket_panel()]
-        else:
-            bp = default_ticket_panel()
-            for i in range(len(data["ticket"]["panels"])):
-                if not isinstance(data["ticket"]["panels"][i], dict):
-                    data["ticket"]["panels"][i] = {}
-                deep_merge(data["ticket"]["panels"][i], bp)
-
-        # ensure rank leaderboard exists
-        data.setdefault("rank", {})
-        data["rank"].setdefault("leaderboard", {})
-        deep_merge(data["rank"]["leaderboard"], default_config()["rank"]["leaderboard"])
-
-        self.save_guild_cfg(gid, data)
+        # 既定値の補完（パネル含む）は保存時に utils.storage 側で行う
+        await self.asave_guild_cfg(gid, data)
         return web.json_response({"status": "ok"})
 
     async def api_ticket_create_panel(self, request):
         gid = request.match_info["gid"]
-        cfg = self.get_guild_cfg(gid)
         try:
             data = await request.json()
         except Exception:
             data = {}
 
         name = (data.get("panel_name") or "new panel").strip()[:32]
-        newp = json.loads(json.dumps(default_ticket_panel(), ensure_ascii=False))
+        newp = default_ticket_panel()
         newp["panel_name"] = name
 
-        cfg["ticket"]["panels"].append(newp)
-        self.save_guild_cfg(gid, cfg)
-        return web.json_response({"status": "ok", "index": len(cfg["ticket"]["panels"]) - 1})
+        def _append(cfg):
+            cfg["ticket"]["panels"].append(newp)
+            return len(cfg["ticket"]["panels"]) - 1
+
+        index = await self.aupdate_guild_cfg(gid, _append)
+        return web.json_response({"status": "ok", "index": index})
 
     async def api_ticket_update_panel(self, request):
         gid = request.match_info["gid"]
-        cfg = self.get_guild_cfg(gid)
         try:
             data = await request.json()
         except Exception:
             return web.json_response({"status": "ng", "error": "invalid json"}, status=400)
 
         idx = _safe_int(data.get("panel_index", 0), 0)
-        if idx < 0 or idx >= len(cfg["ticket"]["panels"]):
-            return web.json_response({"status": "ng", "error": "invalid index"}, status=400)
-
         panel = data.get("panel") or {}
         if not isinstance(panel, dict):
             return web.json_response({"status": "ng", "error": "panel must be object"}, status=400)
 
-        deep_merge(panel, default_ticket_panel())
-        cfg["ticket"]["panels"][idx] = panel
+        panel = deep_merge(default_ticket_panel(), panel)
+
+        def _replace(cfg):
+            if idx < 0 or idx >= len(cfg["ticket"]["panels"]):
+                return False
+            cfg["ticket"]["panels"][idx] = panel
+            return True
 
-        self.save_guild_cfg(gid, cfg)
+        if not await self.aupdate_guild_cfg(gid, _replace):
+            return web.json_response({"status": "ng", "error": "invalid index"}, status=400)
         return web.json_response({"status": "ok"})
 
     async def api_ticket_delete_panel(self, request):
         gid = request.match_info["gid"]
-        cfg = self.get_guild_cfg(gid)
+        cfg = await self.aget_guild_cfg(gid)
         try:
             data = await request.json()
         except Exception:
@@ -624,18 +467,29 @@ class WebManager(commands.Cog):
             if g and str(ch_id).isdigit() and str(msg_id).isdigit():
                 ch = g.get_channel(int(ch_id))
                 if ch:
-                    m = await ch.fetch_message(int(msg_id))
-                    await m.delete()
+                    route = outbound.channel_route(ch)
+                    m = await outbound.call(self.bot, route, outbound.INTERACTIVE, ch.fetch_message, int(msg_id))
+                    await outbound.call(self.bot, route, outbound.INTERACTIVE, m.delete)
         except Exception:
             logger.exception("failed to delete deployed panel message")
 
-        cfg["ticket"]["panels"].pop(idx)
-        self.save_guild_cfg(gid, cfg)
+        # メッセージ削除を待つ間に他の変更が保存されていても消さないよう、最新の設定から外す
+        removed = cfg["ticket"]["panels"][idx]
+
+        def _pop(c):
+            panels = c["ticket"]["panels"]
+            if idx < len(panels) and panels[idx] == removed:
+                panels.pop(idx)
+                return True
+            return False
+
+        if not await self.aupdate_guild_cfg(gid, _pop):
+            return web.json_response({"status": "ng", "error": "panel was modified, reload and retry"}, status=409)
         return web.json_response({"status": "ok"})
 
     async def api_ticket_deploy_panel(self, request):
         gid = request.match_info["gid"]
-        cfg = self.get_guild_cfg(gid)
+        cfg = await self.aget_guild_cfg(gid)
         try:
             data = await request.json()
         except Exception:
@@ -663,10 +517,13 @@ class WebManager(commands.Cog):
 
         msg = await ticket_cog.deploy_panel(channel, idx)
 
-        cfg["ticket"]["panels"][idx].setdefault("deploy", {})
-        cfg["ticket"]["panels"][idx]["deploy"]["channel_id"] = str(channel.id)
-        cfg["ticket"]["panels"][idx]["deploy"]["message_id"] = str(msg.id)
-        self.save_guild_cfg(gid, cfg)
+        def _set_deploy(c):
+            if idx >= len(c["ticket"]["panels"]):
+                return
+            c["ticket"]["panels"][idx].setdefault("deploy", {})
+            c["ticket"]["panels"][idx]["deploy"]["channel_id"] = str(channel.id)
+            c["ticket"]["panels"][idx]["deploy"]["message_id"] = str(msg.id)
+        await self.aupdate_guild_cfg(gid, _set_deploy)
 
         return web.json_response({"status": "ok", "message_id": str(msg.id)})
 
@@ -702,13 +559,13 @@ class WebManager(commands.Cog):
         else:
             return web.json_response({"status": "ng", "error": "Ranking cog has no deploy method"}, status=500)
 
-        cfg = self.get_guild_cfg(gid)
-        cfg.setdefault("rank", {})
-        cfg["rank"].setdefault("leaderboard", {})
-        cfg["rank"]["leaderboard"]["channel_id"] = str(channel.id)
-        if msg:
-            cfg["rank"]["leaderboard"]["message_id"] = str(msg.id)
-        self.save_guild_cfg(gid, cfg)
+        def _set_leaderboard(cfg):
+            cfg.setdefault("rank", {})
+            cfg["rank"].setdefault("leaderboard", {})
+            cfg["rank"]["leaderboard"]["channel_id"] = str(channel.id)
+            if msg:
+                cfg["rank"]["leaderboard"]["message_id"] = str(msg.id)
+        await self.aupdate_guild_cfg(gid, _set_leaderboard)
 
         return web.json_response({"status": "ok", "message_id": str(msg.id) if msg else ""})
 
@@ -460,6 +460,82 @@
     }
   };
 
+  // ---------- Join / Leave ----------
+  function intField(id, def, min) {
+    const v = parseInt($(id)?.value || String(def), 10);
+    return Math.max(min, isNaN(v) ? def : v);
+  }
+
+  window.jlSave = async function (gid) {
+    try {
+      const cfg = window.__CFG__ || {};
+      const jl = (cfg.jl = cfg.jl || {});
+
+      jl.enabled = !!$("jl_enabled")?.checked;
+      jl.channel_join = $("jl_channel_join")?.value || "";
+      jl.channel_leave = $("jl_channel_leave")?.value || "";
+
+      for (const kind of ["join", "leave"]) {
+        const emb = (jl[`${kind}_embed`] = jl[`${kind}_embed`] || {});
+        emb.title = $(`jl_${kind}_title`)?.value || "";
+        emb.description = $(`jl_${kind}_desc`)?.value || "";
+        emb.color = $(`jl_${kind}_color`)?.value || (kind === "join" ? "#5865F2" : "#ED4245");
+        const footer = typeof emb.footer === "object" && emb.footer ? emb.footer : {};
+        footer.text = $(`jl_${kind}_footer`)?.value || "";
+        emb.footer = footer;
+      }
+
+      jl.burst = {
+        enabled: !!$("jl_burst_enabled")?.checked,
+        window_seconds: intField("jl_burst_window", 10, 1),
+        threshold: intField("jl_burst_threshold", 10, 2),
+        flush_seconds: intField("jl_burst_flush", 5, 1),
+        style: $("jl_burst_style")?.value === "embeds" ? "embeds" : "list"
+      };
+
+      await postJson(`/guild/${gid}/api/save_config`, cfg);
+      window.__CFG__ = cfg;
+      toast("✅ Join / Leave を保存しました");
+    } catch (e) {
+      console.error(e);
+      alert("Join / Leave 保存に失敗: " + e.message);
+    }
+  };
+
+  // ---------- Ranking ----------
+  window.rankSave = async function (gid) {
+    try {
+      const cfg = window.__CFG__ || {};
+      cfg.rank = cfg.rank || {};
+      cfg.rank.embed = cfg.rank.embed || {};
+      cfg.rank.leaderboard = cfg.rank.leaderboard || {};
+
+      cfg.rank.enabled = !!$("rank_enabled")?.checked;
+      cfg.rank.embed.title = $("rank_title")?.value || "";
+      cfg.rank.embed.description = $("rank_desc")?.value || "";
+      cfg.rank.embed.color = $("rank_color")?.value || "#6D7CFF";
+
+      const lb = cfg.rank.leaderboard;
+      lb.enabled = !!$("lb_enabled")?.checked;
+      lb.mention = !!$("lb_mention")?.checked;
+      lb.channel_id = $("lb_channel")?.value || "";
+      lb.interval_minutes = Math.max(1, parseInt($("lb_interval")?.value || "10", 10) || 10);
+      lb.top_k = Math.min(25, Math.max(1, parseInt($("lb_top_k")?.value || "5", 10) || 5));
+      lb.show = {
+        text: !!$("lb_show_text")?.checked,
+        vc: !!$("lb_show_vc")?.checked,
+        overall: !!$("lb_show_overall")?.checked
+      };
+
+      await postJson(`/guild/${gid}/api/save_config`, cfg);
+      window.__CFG__ = cfg;
+      toast("✅ Ranking を保存しました");
+    } catch (e) {
+      console.error(e);
+      alert("Ranking 保存に失敗: " + e.message);
+    }
+  };
+
   // ---------- init ----------
   document.addEventListener("DOMContentLoaded", () => {
     try {
@@ -1,38 +1,61 @@
 import discord
 from discord.ext import commands
+import asyncio
 import os
-import json
 import logging
-import datetime
 from pathlib import Path
 from dotenv import load_dotenv
 
+from utils.member_names import MemberNameCache
+from utils.outbound import OutboundQueue
+from utils.stats import StatsAggregator
+from utils.storage import get_backend
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s')
 logger = logging.getLogger("BotMain")
 load_dotenv()
 
+# 統計の書き出し間隔（秒）と日別データの保持日数
+STATS_FLUSH_INTERVAL = int(os.getenv("STATS_FLUSH_INTERVAL", "60"))
+STATS_RETENTION_DAYS = int(os.getenv("STATS_RETENTION_DAYS", "90"))
+
+# Discordへの書き込みの同時実行数と、そのうちバックグラウンド処理（リーダーボード等）が使える数
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", "4"))
+OUTBOUND_BACKGROUND_SLOTS = int(os.getenv("OUTBOUND_BACKGROUND_SLOTS", "1"))
+
+# メンバー表示名キャッシュの件数上限と有効期間（秒）
+MEMBER_NAME_CACHE_SIZE = int(os.getenv("MEMBER_NAME_CACHE_SIZE", "10000"))
+MEMBER_NAME_TTL = int(os.getenv("MEMBER_NAME_TTL", "3600"))
+
 class MyBot(commands.Bot):
     def __init__(self):
         intents = discord.Intents.all()
         super().__init__(command_prefix="!", intents=intents)
         self.web_started = False
+        self.stats = StatsAggregator(retention_days=STATS_RETENTION_DAYS)
+        # ✅ 送信/編集/作成はここを通す（ユーザー操作 > Join/Leave > リーダーボード の優先順）
+        self.outbound = OutboundQueue(OUTBOUND_WORKERS, OUTBOUND_BACKGROUND_SLOTS)
+        # ✅ リーダーボード/Web管理画面の表示名はここから（ユーザーごとのAPI取得はしない）
+        self.member_names = MemberNameCache(MEMBER_NAME_CACHE_SIZE, MEMBER_NAME_TTL)
 
     def update_stats(self, guild_id, key):
-        today = datetime.date.today().isoformat()
-        path = Path(f"data/stats/{guild_id}.json")
-        path.parent.mkdir(parents=True, exist_ok=True)
+        # ✅ メモリ集計のみ（ファイル書き込みは _stats_flush_loop がスレッドで行う）
+        self.stats.incr(guild_id, key)
 
-        data = json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
-        if today not in data:
-            data[today] = {"messages": 0, "joins": 0, "leaves": 0}
-
-        data[today][key] += 1
-        path.write_text(json.dumps(data, indent=4, ensure_ascii=False), encoding="utf-8")
+    async def _stats_flush_loop(self):
+        while not self.is_closed():
+            await asyncio.sleep(STATS_FLUSH_INTERVAL)
+            try:
+                await self.stats.flush()
+            except Exception:
+                logger.exception("stats flush failed")
 
     async def setup_hook(self):
         for d in ["settings/guilds", "data/tickets", "data/stats", "data/ranking"]:
             Path(d).mkdir(parents=True, exist_ok=True)
 
+        self.loop.create_task(self._stats_flush_loop())
+
         # ✅ Webは cogs.web_admin をロード（__init__.pyのsetupが起動する）
         exts = [
             "cogs.web_admin",
@@ -43,6 +66,23 @@ class MyBot(commands.Bot):
         for ext in exts:
             await self.load_extension(ext)
 
+    async def close(self):
+        try:
+            await self.stats.flush()
+        except Exception:
+            logger.exception("stats flush on close failed")
+        # 送信中のDiscordリクエストを終わらせてから接続を閉じる
+        try:
+            await self.outbound.close()
+        except Exception:
+            logger.exception("outbound close failed")
+        await super().close()
+        # Cogのunloadで書かれた分も含めて、まとめ書き待ちを確定させる
+        try:
+            get_backend().flush()
+        except Exception:
+            logger.exception("storage flush on close failed")
+
     async def on_ready(self):
         logger.info(f"Logged in as {self.user}")
         try:
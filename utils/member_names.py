@@ -0,0 +1,103 @@
+import collections
+import logging
+import time
+
+logger = logging.getLogger("MemberNames")
+
+# query_members に一度に渡せるユーザーIDの上限（Discordの制限）
+QUERY_CHUNK = 100
+
+_MISSING = object()
+
+
+class MemberNameCache:
+    """
+    (guild_id, user_id) -> 表示名 の LRU（TTL付き）。
+    足りない分はギルドのメンバーキャッシュ → query_members（100件ずつ）でまとめて引く。
+    見つからなかったID（退出済みなど）も miss_ttl の間は覚えておき、毎回問い合わせない。
+    """
+
+    def __init__(self, max_size=10000, ttl=3600, miss_ttl=600):
+        self.max_size = max(1, int(max_size))
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self._items = collections.OrderedDict()  # (gid, uid) -> (name or None, 期限)
+        self.stats = {"hits": 0, "misses": 0, "queried": 0}
+
+    def __len__(self):
+        return len(self._items)
+
+    def _get(self, key, now):
+        ent = self._items.get(key)
+        if ent is None:
+            return _MISSING
+        if ent[1] < now:
+            del self._items[key]
+            return _MISSING
+        self._items.move_to_end(key)
+        return ent[0]
+
+    def put(self, guild_id, user_id, name, ttl=None):
+        if ttl is None:
+            ttl = self.ttl if name is not None else self.miss_ttl
+        key = (int(guild_id), int(user_id))
+        self._items[key] = (name, time.monotonic() + ttl)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def remember(self, member):
+        """発言者など、手元にあるメンバーの名前を覚える（API呼び出しなし）"""
+        guild = getattr(member, "guild", None)
+        if guild is not None:
+            self.put(guild.id, member.id, member.display_name)
+
+    async def resolve(self, guild, user_ids):
+        """{uid(str): 表示名 or None}。None は見つからなかった（退出済みなど）"""
+        now = time.monotonic()
+        out = {}
+        todo = []
+        for uid in dict.fromkeys(str(u) for u in user_ids):
+            if not uid.isdigit():
+                out[uid] = None
+                continue
+            name = self._get((guild.id, int(uid)), now)
+            if name is not _MISSING:
+                self.stats["hits"] += 1
+                out[uid] = name
+                continue
+            self.stats["misses"] += 1
+            m = guild.get_member(int(uid))
+            if m is not None:
+                self.put(guild.id, m.id, m.display_name)
+                out[uid] = m.display_name
+            else:
+                todo.append(int(uid))
+
+        for i in range(0, len(todo), QUERY_CHUNK):
+            chunk = todo[i:i + QUERY_CHUNK]
+            try:
+                members = await guild.query_members(user_ids=chunk, limit=len(chunk), cache=False)
+            except Exception:
+                # 失敗は覚えない（次回また引く）
+                logger.warning("query_members failed: guild=%s n=%d", guild.id, len(chunk))
+                continue
+            self.stats["queried"] += len(chunk)
+            found = {m.id: m.display_name for m in members}
+            for uid in chunk:
+                name = found.get(uid)
+                self.put(guild.id, uid, name)
+                out[str(uid)] = name
+        return out
+
+
+async def resolve(bot, guild, user_ids):
+    """bot.member_names があればそれを使い、無ければメンバーキャッシュだけで引く"""
+    cache = getattr(bot, "member_names", None)
+    if cache is not None:
+        return await cache.resolve(guild, user_ids)
+    out = {}
+    for uid in user_ids:
+        m = guild.get_member(int(uid)) if str(uid).isdigit() else None
+        out[str(uid)] = m.display_name if m else None
+    return out
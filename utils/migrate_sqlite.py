@@ -0,0 +1,64 @@
+"""
+既存のJSONデータをSQLiteへ取り込む一回限りのツール。
+
+    python -m utils.migrate_sqlite [data/kamosaba.db]
+
+取り込み後に .env で STORAGE_BACKEND=sqlite を設定して起動する。
+同じDBへ再実行しても上書き（upsert）になるだけで重複はしない。
+"""
+import logging
+import re
+import sys
+from pathlib import Path
+
+from utils.storage import JsonBackend, SqliteBackend
+
+logger = logging.getLogger("MigrateSqlite")
+
+_COUNTER_RE = re.compile(r"^(text|vc)_(\d+)\.json$")
+_NAMES_RE = re.compile(r"^names_(\d+)\.json$")
+
+
+def migrate(db_path="data/kamosaba.db", root="data"):
+    src = JsonBackend(root)
+    dst = SqliteBackend(db_path)
+    root = Path(root)
+    done = {"tickets": 0, "counters": 0, "names": 0, "stats": 0}
+
+    for p in sorted((root / "tickets").glob("*.json")):
+        if not p.stem.isdigit():
+            continue
+        store = src.load_tickets(p.stem)
+        dst.save_tickets(p.stem, store)
+        done["tickets"] += len(store["tickets"])
+
+    for p in sorted((root / "ranking").glob("*.json")):
+        m = _COUNTER_RE.match(p.name)
+        if m:
+            kind, gid = m.groups()
+            data = src.load_counters(kind, gid)
+            dst.write_counters(kind, gid, data, data.keys())
+            done["counters"] += len(data)
+            continue
+        m = _NAMES_RE.match(p.name)
+        if m:
+            names = src.load_last_names(m.group(1))
+            dst.save_last_names(m.group(1), names)
+            done["names"] += len(names)
+
+    for p in sorted((root / "stats").glob("*.json")):
+        if not p.stem.isdigit():
+            continue
+        data = src.load_stats(p.stem)
+        dst.import_stats(p.stem, data)
+        done["stats"] += len([d for d in data if d != "monthly"])
+
+    dst.close()
+    return done
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    db = sys.argv[1] if len(sys.argv) > 1 else "data/kamosaba.db"
+    result = migrate(db)
+    logger.info("migrated into %s: %s", db, result)
@@ -0,0 +1,172 @@
+import asyncio
+import collections
+import itertools
+import logging
+import time
+
+logger = logging.getLogger("Outbound")
+
+# 優先度（小さいほど先）
+INTERACTIVE = 0  # チケット作成/クローズなどユーザー操作への応答
+NOTIFY = 1       # Join/Leave 通知
+BACKGROUND = 2   # リーダーボード更新・自動削除など
+
+
+def channel_route(channel_or_id):
+    """メッセージ送信/編集/削除のバケット（Discordはチャンネル単位で制限する）"""
+    return ("channel", int(getattr(channel_or_id, "id", channel_or_id)))
+
+
+def guild_route(guild_or_id):
+    """チャンネル/スレッド作成のバケット（ギルド単位）"""
+    return ("guild", int(getattr(guild_or_id, "id", guild_or_id)))
+
+
+class OutboundQueue:
+    """
+    Discordへの書き込みを優先度つきで順番に実行する。
+    - 同じルート（バケット）へのリクエストは同時に1本だけ（429を受けたら retry_after の間止める）
+    - BACKGROUND が同時に使えるのは background_slots 本まで（残りは常に上位の優先度用に空けておく）
+    """
+
+    def __init__(self, workers=4, background_slots=1):
+        self.workers = max(1, int(workers))
+        self.background_slots = max(1, min(self.workers - 1, int(background_slots))) if self.workers > 1 else 1
+        self._queues = [collections.deque() for _ in (INTERACTIVE, NOTIFY, BACKGROUND)]
+        self._seq = itertools.count()
+        self._busy = set()          # 実行中のルート
+        self._blocked = {}          # route -> 再開できる時刻（monotonic）
+        self._active = 0
+        self._active_bg = 0
+        self._timer = None
+        self._tasks = set()         # 実行中のタスク（ループは弱参照しか持たないのでここで保持）
+        self._closed = False
+        self.stats = {"done": 0, "failed": 0, "rate_limited": 0}
+
+    def __len__(self):
+        return sum(len(q) for q in self._queues)
+
+    async def run(self, route, priority, fn, *args, **kwargs):
+        """fn(*args, **kwargs)（コルーチン関数）を順番が来たら実行して結果を返す"""
+        if self._closed:
+            raise RuntimeError("outbound queue is closed")
+        fut = asyncio.get_running_loop().create_future()
+        prio = max(INTERACTIVE, min(BACKGROUND, int(priority)))
+        self._queues[prio].append((next(self._seq), route, fut, fn, args, kwargs))
+        self._pump()
+        return await fut
+
+    def _ready(self, route, now):
+        if route in self._busy:
+            return False
+        until = self._blocked.get(route)
+        if until is None:
+            return True
+        if until <= now:
+            del self._blocked[route]
+            return True
+        return False
+
+    def _pick(self, now):
+        for prio, q in enumerate(self._queues):
+            if prio == BACKGROUND and self._active_bg >= self.background_slots:
+                break
+            for i, item in enumerate(q):
+                fut = item[2]
+                if fut.done():
+                    continue  # 呼び出し側がキャンセル済み（後で掃除される）
+                if self._ready(item[1], now):
+                    del q[i]
+                    return prio, item
+        return None
+
+    def _purge(self):
+        for q in self._queues:
+            while q and q[0][2].done():
+                q.popleft()
+
+    def _pump(self):
+        self._purge()
+        now = time.monotonic()
+        while self._active < self.workers:
+            picked = self._pick(now)
+            if picked is None:
+                break
+            prio, item = picked
+            self._active += 1
+            if prio == BACKGROUND:
+                self._active_bg += 1
+            self._busy.add(item[1])
+            task = asyncio.ensure_future(self._exec(prio, item))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        self._arm_timer(now)
+
+    def _arm_timer(self, now):
+        # 429で止めたルートの再開時刻に起こす
+        if self._timer is not None or not self._blocked or not len(self):
+            return
+        delay = max(0.0, min(self._blocked.values()) - now)
+        self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    async def close(self, timeout=5.0):
+        """
+        新規受付を止め、待ち行列の分はキャンセルする。
+        実行中のリクエストは timeout 秒まで完了を待ち、残りはキャンセルする。
+        """
+        self._closed = True
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for q in self._queues:
+            while q:
+                q.popleft()[2].cancel()
+        tasks = list(self._tasks)
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for t in pending:
+            t.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def _on_timer(self):
+        self._timer = None
+        self._pump()
+
+    async def _exec(self, prio, item):
+        _, route, fut, fn, args, kwargs = item
+        try:
+            result = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            # HTTPException(429) / discord.RateLimited（どちらも retry_after 付き）
+            if getattr(e, "status", None) == 429 or getattr(e, "retry_after", None) is not None:
+                retry = float(getattr(e, "retry_after", 1.0) or 1.0)
+                self._blocked[route] = time.monotonic() + retry
+                self.stats["rate_limited"] += 1
+                logger.warning("rate limited: route=%s retry_after=%.1fs", route, retry)
+            self.stats["failed"] += 1
+            if not fut.done():
+                fut.set_exception(e)
+        else:
+            self.stats["done"] += 1
+            if not fut.done():
+                fut.set_result(result)
+        finally:
+            self._active -= 1
+            if prio == BACKGROUND:
+                self._active_bg -= 1
+            self._busy.discard(route)
+            if not self._closed:
+                self._pump()
+
+
+async def call(bot, route, priority, fn, *args, **kwargs):
+    """bot.outbound があればそこを通し、無ければ直接呼ぶ"""
+    q = getattr(bot, "outbound", None)
+    if q is None:
+        return await fn(*args, **kwargs)
+    return await q.run(route, priority, fn, *args, **kwargs)
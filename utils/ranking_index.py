@@ -0,0 +1,166 @@
+import heapq
+
+
+def overall_score(text_count, vc_seconds):
+    """総合スコア = (メッセージ数 + VC分) / 2"""
+    return int((int(text_count) + int(vc_seconds) // 60) / 2)
+
+
+class TopK:
+    """
+    スコアが増えるだけのカウンタについて上位K件を維持する。
+    枠外のユーザーが入るのは「最下位より大きくなった時」だけなので、
+    更新は O(log K)、取り出しは O(K log K)。
+    """
+
+    def __init__(self, k):
+        self.k = max(1, int(k))
+        self._members = {}  # uid -> score（上位K件）
+        self._heap = []     # (score, uid) 最小ヒープ（古いエントリは遅延削除）
+
+    def _min(self):
+        while self._heap:
+            score, uid = self._heap[0]
+            if self._members.get(uid) == score:
+                return score, uid
+            heapq.heappop(self._heap)
+        return None
+
+    def _push(self, uid, score):
+        self._members[uid] = score
+        heapq.heappush(self._heap, (score, uid))
+        # 上位内の更新で溜まった古いエントリを時々掃除
+        if len(self._heap) > 4 * self.k + 64:
+            self._heap = [(s, u) for u, s in self._members.items()]
+            heapq.heapify(self._heap)
+
+    def update(self, uid, score):
+        if uid in self._members or len(self._members) < self.k:
+            self._push(uid, score)
+            return
+        low = self._min()
+        if low is not None and score > low[0]:
+            del self._members[low[1]]
+            heapq.heappop(self._heap)
+            self._push(uid, score)
+
+    def items(self):
+        """[(uid, score), ...] スコア降順"""
+        return sorted(self._members.items(), key=lambda x: x[1], reverse=True)
+
+
+class ScoreIndex:
+    """
+    スコアごとの人数を Fenwick 木（BIT）で保持し、順位・パーセンタイルを O(log S) で返す。
+    S は最大スコア。木はスコアが収まらなくなった時に倍々で作り直す。
+    """
+
+    def __init__(self, scores=None):
+        self._scores = {}  # uid -> score
+        self._size = 1024
+        self._tree = [0] * (self._size + 1)
+        for uid, score in (scores or {}).items():
+            self._scores[uid] = max(0, int(score))
+        self._rebuild(max(self._scores.values(), default=0))
+
+    @property
+    def total(self):
+        return len(self._scores)
+
+    def _rebuild(self, need):
+        size = self._size
+        while size <= need:
+            size *= 2
+        self._size = size
+        tree = [0] * (size + 1)
+        for score in self._scores.values():
+            tree[score + 1] += 1
+        # O(S) で部分和の木にする
+        for i in range(1, size + 1):
+            j = i + (i & -i)
+            if j <= size:
+                tree[j] += tree[i]
+        self._tree = tree
+
+    def _add(self, score, delta):
+        i = score + 1
+        while i <= self._size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def _count_le(self, score):
+        """score 以下の人数"""
+        i = min(score + 1, self._size)
+        n = 0
+        while i > 0:
+            n += self._tree[i]
+            i -= i & -i
+        return n
+
+    def update(self, uid, score):
+        score = max(0, int(score))
+        old = self._scores.get(uid)
+        if old == score:
+            return
+        self._scores[uid] = score
+        if score >= self._size:
+            self._rebuild(score)
+            return
+        if old is not None:
+            self._add(old, -1)
+        self._add(score, 1)
+
+    def position(self, uid):
+        """順位（1始まり、同点は同順位）。未登録なら None"""
+        score = self._scores.get(uid)
+        if score is None:
+            return None
+        return self.total - self._count_le(score) + 1
+
+    def percentile(self, uid):
+        """自分より低いスコアの人の割合（%）。未登録なら None"""
+        score = self._scores.get(uid)
+        if score is None or self.total == 0:
+            return None
+        below = self._count_le(score - 1) if score > 0 else 0
+        return 100.0 * below / self.total
+
+
+class RankBoard:
+    """
+    ギルド1つ分のテキスト/VC/総合の上位K件。
+    text/vc はカウンタ本体（CounterStore.get の辞書）をそのまま参照する。
+    """
+
+    def __init__(self, text, vc, k=5):
+        self.k = k
+        self.text = text
+        self.vc = vc
+        self.top_text = TopK(k)
+        self.top_vc = TopK(k)
+        self.top_overall = TopK(k)
+        for uid, v in text.items():
+            self.top_text.update(uid, v)
+        for uid, v in vc.items():
+            self.top_vc.update(uid, v)
+        overall = {uid: self.overall(uid) for uid in set(text) | set(vc)}
+        for uid, score in overall.items():
+            self.top_overall.update(uid, score)
+        # /rank の順位用（総合スコア）
+        self.index = ScoreIndex(overall)
+
+    def overall(self, uid):
+        return overall_score(self.text.get(uid, 0), self.vc.get(uid, 0))
+
+    def _on_overall(self, uid):
+        score = self.overall(uid)
+        self.top_overall.update(uid, score)
+        self.index.update(uid, score)
+
+    def on_text(self, uid):
+        self.top_text.update(uid, self.text.get(uid, 0))
+        self._on_overall(uid)
+
+    def on_vc(self, uid):
+        self.top_vc.update(uid, self.vc.get(uid, 0))
+        self._on_overall(uid)
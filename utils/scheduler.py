@@ -0,0 +1,74 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class DeadlineQueue:
+    """
+    key ごとの期限（epoch秒）を最小ヒープで保持する。
+    同じ key を再登録すると古いエントリは無効になる（取り出し時に読み飛ばす遅延削除）。
+    wait() は一番近い期限まで眠り、より早い期限が登録されたら起きる。
+    """
+
+    def __init__(self):
+        self._heap = []     # (deadline, seq, key)
+        self._live = {}     # key -> seq（有効なエントリ）
+        self._seq = itertools.count()
+        self._wake = asyncio.Event()
+
+    def __len__(self):
+        return len(self._live)
+
+    def __contains__(self, key):
+        return key in self._live
+
+    def schedule(self, key, deadline):
+        head = self.next_deadline()
+        seq = next(self._seq)
+        self._live[key] = seq
+        heapq.heappush(self._heap, (float(deadline), seq, key))
+        if head is None or deadline < head:
+            self.wake()
+
+    def cancel(self, key):
+        self._live.pop(key, None)
+
+    def wake(self):
+        self._wake.set()
+
+    def _drop_stale(self):
+        while self._heap and self._live.get(self._heap[0][2]) != self._heap[0][1]:
+            heapq.heappop(self._heap)
+
+    def next_deadline(self):
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now=None):
+        """期限を過ぎた key を期限順に取り出す"""
+        now = time.time() if now is None else now
+        out = []
+        while True:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return out
+            _, _, key = heapq.heappop(self._heap)
+            del self._live[key]
+            out.append(key)
+
+    async def wait(self, max_sleep=None):
+        """次の期限・wake()・max_sleep のいずれか早い方まで待つ"""
+        nd = self.next_deadline()
+        timeout = None if nd is None else max(0.0, nd - time.time())
+        if max_sleep is not None:
+            timeout = max_sleep if timeout is None else min(timeout, max_sleep)
+        if self._wake.is_set():
+            # 前回の待ちの後（処理中）に起こされていた
+            self._wake.clear()
+            return
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
@@ -0,0 +1,68 @@
+import asyncio
+import datetime
+import logging
+
+from utils.storage import _empty_day, get_backend, run_io
+
+logger = logging.getLogger("Stats")
+
+
+class StatsAggregator:
+    """
+    日別統計（messages/joins/leaves）をメモリで集計し、定期的にまとめて書き出す。
+    incr() はディスクに一切触れない。書き出しは flush() がスレッドでバックエンドへ行う
+    （保持期間を過ぎた日は月次合計へ畳み込まれる）。
+    """
+
+    def __init__(self, retention_days=90):
+        self.retention_days = int(retention_days)
+        self._pending = {}  # gid(str) -> {date: {key: n}}
+        self._lock = asyncio.Lock()
+
+    def incr(self, guild_id, key, n=1):
+        today = datetime.date.today().isoformat()
+        day = self._pending.setdefault(str(guild_id), {}).setdefault(today, {})
+        day[key] = day.get(key, 0) + int(n)
+
+    def overlay(self, guild_id, data):
+        """ディスク上のデータに未書き出し分を足したコピーを返す（表示用）"""
+        out = {k: dict(v) if isinstance(v, dict) else v for k, v in (data or {}).items()}
+        for day, row in self._pending.get(str(guild_id), {}).items():
+            cur = out.setdefault(day, _empty_day())
+            for k, v in row.items():
+                cur[k] = int(cur.get(k, 0)) + v
+        return out
+
+    def _write_all(self, pending):
+        """書き出せなかった分を gid -> {date: {key: n}} で返す"""
+        today = datetime.date.today()
+        backend = get_backend()
+        failed = {}
+        for key, deltas in pending.items():
+            try:
+                backend.add_stats(key, deltas, self.retention_days, today)
+            except Exception:
+                logger.exception("stats flush failed: %s", key)
+                failed[key] = deltas
+        return failed
+
+    def _restore(self, failed):
+        # 失敗した分は次回また書く（書き出し中に増えた分と足し合わせる）
+        for gid, days in failed.items():
+            cur = self._pending.setdefault(gid, {})
+            for day, row in days.items():
+                d = cur.setdefault(day, {})
+                for k, v in row.items():
+                    d[k] = d.get(k, 0) + v
+
+    async def flush(self):
+        async with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            try:
+                failed = await run_io(("stats",), self._write_all, pending)
+            except BaseException:
+                self._restore(pending)
+                raise
+            self._restore(failed)
@@ -1,6 +1,58 @@
+import asyncio
+import contextlib
+import copy
+import datetime
+import functools
 import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+logger = logging.getLogger("Storage")
+
+# ✅ チケットパネル1つ分の既定値（Bot/Web共通）
+DEFAULT_TICKET_PANEL = {
+    "panel_name": "質問",
+    "enabled": True,
+    "deploy": {"channel_id": "", "message_id": ""},
+
+    "mode": "channel",  # channel / thread
+    "parent_category_id": "",
+    "thread_parent_channel_id": "",
+    "name_template": "ticket-{count}-{user}",
+    "types": ["質問", "不具合", "申請", "通報"],
+
+    "limits": {"max_open_per_user": 5, "cooldown_minutes": 30},
+
+    "permissions": {"staff_role_ids": [], "viewer_role_ids": []},
+
+    "form": {"enabled": False, "fields": []},
+
+    "rules": {
+        "enabled": False,
+        "title": "📌ルール・注意事項",
+        "body": "",
+        "allow_everyone_mention": False,
+        "allowed_role_ids": [],
+        "policy": "staff_only"
+    },
+
+    "close": {
+        "confirm_required": True,
+        "closed_category_id": "",
+        "allow_reopen": True,
+        "delete_after_days": 14
+    },
+
+    "auto_delete": {"enabled": False, "inactive_minutes": 0}
+}
+
+# ✅ ギルド設定の既定値（Bot/Web共通のスキーマ）
 DEFAULT_GUILD_CONFIG = {
     "lang": "ja",
 
@@ -27,52 +79,25 @@ DEFAULT_GUILD_CONFIG = {
             "show_join_order": False,
             "show_member_count": True,
             "show_avatar": True
-        }
+        },
+        # 参加/退出が window_seconds 内に threshold 件以上来たら、flush_seconds ごとにまとめて通知
+        # style: list（一覧Embed） / embeds（通常のEmbedを最大10件ずつ1メッセージに）
+        "burst": {
+            "enabled": True,
+            "threshold": 10,
+            "window_seconds": 10,
+            "flush_seconds": 5,
+            "style": "list",
+        },
     },
 
     "ticket": {
-        "limits": {"max_open_per_user": 5, "cooldown_minutes": 30},
-        "auto": {"closed_delete_days": 14, "inactivity_delete_hours": 0},
-        "log_channel_id": "",
-        "panels": [
-            {
-                "panel_id": "default",
-                "panel_name": "質問",
-                "enabled": True,
-                "mode": "channel",  # channel/thread
-                "name_template": "ticket-{count}-{user_id}",
-                "create_message": "内容を送ってください。必要なら参考画像も添付OKです。",
-                "rules_embed": {
-                    "title": "ルール / 注意事項",
-                    "description": "誹謗中傷は禁止です。\n必要な情報をできるだけ詳しく書いてください。",
-                    "color": "#5865F2",
-                    "footer": {"text": "", "icon_url": ""}
-                },
-                "staff_role_ids": [],
-                "close_category_id": "",
-                "reopen_enabled": True,
-                "modal": {
-                    "enabled": True,
-                    "genre_label": "ジャンル",
-                    "body_label": "本文",
-                    "urgency_label": "緊急度",
-                    "allow_reference_image": True
-                },
-                "embed": {
-                    "title": "サポート",
-                    "description": "下のボタンからチケットを作成できます。",
-                    "button_label": "チケット作成",
-                    "color": "#5865F2"
-                },
-                # ✅設置済みメッセージ追跡（deployで自動追記）
-                "deployments": []  # [{"channel_id":"...", "message_id":"..."}]
-            }
-        ]
+        "enabled": True,
+        "panels": [DEFAULT_TICKET_PANEL],
     },
 
     "rank": {
         "enabled": True,
-        "cooldown": 60,
         "embed": {
             "title": "ランク - {user}",
             "description": "あなたの現在のランク情報です。",
@@ -80,7 +105,8 @@ DEFAULT_GUILD_CONFIG = {
             "fields": [
                 {"name": "テキスト", "value": "{text_count}", "inline": True},
                 {"name": "VC", "value": "{vc_time}", "inline": True},
-                {"name": "総合", "value": "{overall_score}", "inline": True}
+                {"name": "総合", "value": "{overall_score}", "inline": True},
+                {"name": "順位", "value": "#{position} / {total_ranked}（{percentile}%）", "inline": True}
             ],
             "footer": {"text": "", "icon_url": ""}
         },
@@ -90,11 +116,19 @@ DEFAULT_GUILD_CONFIG = {
             "enabled": False,
             "channel_id": "",
             "interval_minutes": 10,
-            "message_id": ""  # deploy時に保存（再起動後も編集更新する）
+            "top_k": 5,  # 各ランキングの表示件数（1〜25）
+            "message_id": "",  # deploy時に保存（再起動後も編集更新する）
+            "mention": False,
+            "show": {"text": True, "vc": True, "overall": True}
         }
     }
 }
 
+
+def default_ticket_panel():
+    return copy.deepcopy(DEFAULT_TICKET_PANEL)
+
+
 def deep_merge(default, data):
     out = dict(default)
     for k, v in data.items():
@@ -104,39 +138,967 @@ def deep_merge(default, data):
             out[k] = v
     return out
 
+# -------------------------
+# atomic / coalesced writes
+# -------------------------
+# none: fsyncしない / file: 一時ファイルをfsync（既定） / full: ディレクトリもfsync
+FSYNC_POLICY = os.getenv("STORAGE_FSYNC", "file").strip().lower()
+
+
+def _fsync_dir(d):
+    try:
+        fd = os.open(str(d), os.O_RDONLY)
+    except OSError:
+        return  # Windowsなどディレクトリを開けない環境
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write_text(path, text, fsync=None):
+    """
+    同じディレクトリの一時ファイルに書いてから rename する。
+    途中でプロセスが落ちても元のファイルか新しいファイルのどちらかが残る（途中切れにならない）。
+    """
+    policy = FSYNC_POLICY if fsync is None else fsync
+    p = Path(path)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix="." + p.name + ".", suffix=".tmp", dir=str(p.parent))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            if policy in ("file", "full"):
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, str(p))
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    if policy == "full":
+        _fsync_dir(p.parent)
+
+
+def dump_json(data, indent=None):
+    """indent=None はコンパクト形式（大きいデータファイル用）"""
+    if indent is None:
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return json.dumps(data, ensure_ascii=False, indent=indent)
+
+
+def atomic_write_json(path, data, indent=None, fsync=None):
+    atomic_write_text(path, dump_json(data, indent), fsync=fsync)
+
+
+def quarantine(path):
+    """壊れたファイルを *.corrupt-<時刻> として退避し、上書きで証拠が消えないようにする"""
+    p = Path(path)
+    dst = p.with_name("{}.corrupt-{}".format(p.name, int(time.time())))
+    try:
+        os.replace(str(p), str(dst))
+        logger.error("corrupt file moved: %s -> %s", p, dst)
+    except OSError:
+        logger.exception("failed to quarantine %s", p)
+
+
+# -------------------------
+# keyed locks / coalesced writes
+# -------------------------
+class KeyedLocks:
+    """
+    キー（("tickets", gid) など、ギルド+データ種別）ごとのロック。
+    別ギルド同士は互いに待たない。使われていないキーのロックは破棄する。
+    factory: threading.RLock（I/Oスレッド用） / asyncio.Lock（イベントループ用）
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._guard = threading.Lock()
+        self._locks = {}  # key -> [lock, 利用中の数]
+
+    def _enter(self, key):
+        with self._guard:
+            ent = self._locks.get(key)
+            if ent is None:
+                ent = self._locks[key] = [self._factory(), 0]
+            ent[1] += 1
+            return ent[0]
+
+    def _leave(self, key):
+        with self._guard:
+            ent = self._locks.get(key)
+            if ent is not None:
+                ent[1] -= 1
+                if ent[1] <= 0:
+                    del self._locks[key]
+
+    @contextlib.contextmanager
+    def hold(self, key):
+        lock = self._enter(key)
+        try:
+            with lock:
+                yield
+        finally:
+            self._leave(key)
+
+    @contextlib.asynccontextmanager
+    async def ahold(self, key):
+        lock = self._enter(key)
+        try:
+            async with lock:
+                yield
+        finally:
+            self._leave(key)
+
+
+# 読み込み→変更→書き込み を行う処理はこのロック内で（同じスレッドからの入れ子はOK）
+file_locks = KeyedLocks(threading.RLock)
+
+
+class CoalescingWriter:
+    """
+    同じファイルへの連続した書き込みを delay 秒まとめ、最後の内容だけを atomic に書く。
+    内容は書き込み要求の時点で文字列化する（後から元データが変更されても影響しない）。
+    まだ書いていない内容は peek() で読める。
+    """
+
+    def __init__(self, delay=0.5):
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()  # flush同士を直列化（古い内容が後から書かれないように）
+        self._pending = {}   # path(str) -> text
+        self._inflight = {}  # 書き込み中（まだ読めるようにしておく）
+        self._timer = None
+
+    def write(self, path, text):
+        with self._lock:
+            self._pending[str(path)] = text
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def peek(self, path):
+        key = str(path)
+        with self._lock:
+            text = self._pending.get(key)
+            return text if text is not None else self._inflight.get(key)
+
+    def flush(self):
+        with self._io_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._inflight = dict(pending)
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            for path, text in pending.items():
+                try:
+                    atomic_write_text(path, text)
+                except Exception:
+                    logger.exception("coalesced write failed: %s", path)
+            with self._lock:
+                self._inflight = {}
+
+
 def guild_config_path(guild_id):
     return Path("settings/guilds/{}/config.json".format(guild_id))
 
-def load_guild_config(guild_id):
+
+def config_lock_key(guild_id):
+    """設定ファイルのロック鍵（Bot側とWeb側で同じものを使う）"""
+    return ("config", str(guild_id))
+
+
+# -------------------------
+# config cache
+# -------------------------
+# gid(str) -> {"sig": (mtime_ns, size), "cfg": dict}
+_CONFIG_CACHE = {}
+# gid(str) -> int（保存/外部変更のたびに+1）
+_CONFIG_VERSIONS = {}
+
+
+def _file_sig(p):
+    try:
+        st = p.stat()
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+# 設定変更時に呼ばれる (callback(guild_id: str), 登録時のイベントループ)
+_CONFIG_LISTENERS = []
+
+
+def add_config_listener(fn):
+    """
+    設定が保存/外部変更された時に fn(guild_id) を呼ぶ（スケジューラの再計算用）。
+    読み書きはI/Oスレッドでも行われるので、登録したループ上で呼び出す。
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    _CONFIG_LISTENERS.append((fn, loop))
+
+
+def remove_config_listener(fn):
+    _CONFIG_LISTENERS[:] = [x for x in _CONFIG_LISTENERS if x[0] != fn]
+
+
+def _bump_version(key):
+    _CONFIG_VERSIONS[key] = _CONFIG_VERSIONS.get(key, 0) + 1
+    for fn, loop in list(_CONFIG_LISTENERS):
+        try:
+            if loop is not None and not loop.is_closed():
+                loop.call_soon_threadsafe(fn, key)
+            else:
+                fn(key)
+        except Exception:
+            logger.exception("config listener failed")
+
+
+def _remember(key, cfg, sig):
+    _CONFIG_CACHE[key] = {"sig": sig, "cfg": cfg}
+    _bump_version(key)
+
+
+def guild_config_version(guild_id):
+    """設定が変わるたびに増える番号（キャッシュの鍵に使う）"""
+    return _CONFIG_VERSIONS.get(str(guild_id), 0)
+
+
+def invalidate_guild_config(guild_id):
+    """外部（Web管理画面など）が直接書き込んだ後に呼ぶ"""
+    key = str(guild_id)
+    _CONFIG_CACHE.pop(key, None)
+    _bump_version(key)
+
+
+def _migrate_legacy(data):
+    """旧Web管理画面の形式（jl.channels / jl.filters / 文字列のfooter）をBotと同じ形式へ"""
+    jl = data.get("jl")
+    if not isinstance(jl, dict):
+        return
+    jl = data["jl"] = dict(jl)
+    channels = jl.pop("channels", None)
+    if isinstance(channels, dict):
+        for kind in ("join", "leave"):
+            if not jl.get("channel_" + kind) and channels.get(kind):
+                jl["channel_" + kind] = channels[kind]
+    filters = jl.pop("filters", None)
+    if isinstance(filters, dict) and "filter" not in jl:
+        jl["filter"] = filters
+    for kind in ("join_embed", "leave_embed"):
+        emb = jl.get(kind)
+        if isinstance(emb, dict) and isinstance(emb.get("footer"), str):
+            jl[kind] = dict(emb, footer={"text": emb["footer"], "icon_url": ""})
+
+
+def normalize_guild_config(data):
+    """既定値で不足を埋めた設定（data は変更しない）。Bot/Webどちらの保存もこれを通す"""
+    data = dict(data) if isinstance(data, dict) else {}
+    _migrate_legacy(data)
+    merged = deep_merge(copy.deepcopy(DEFAULT_GUILD_CONFIG), data)
+
+    # panels最低1保証 + 各パネルの不足キーを補完
+    panels = merged.get("ticket", {}).get("panels", [])
+    if not isinstance(panels, list) or len(panels) == 0:
+        panels = [{}]
+    merged["ticket"]["panels"] = [
+        deep_merge(default_ticket_panel(), p2 if isinstance(p2, dict) else {}) for p2 in panels
+    ]
+    return merged
+
+
+def load_guild_config(guild_id, readonly=False):
+    """
+    キャッシュ済みの設定を返す（既定では呼び出し側が書き換えても良いようにコピー）。
+    ファイルの mtime/size が変わった時だけ読み直す。読み込みでは書き込まない
+    （既定値の補完はメモリ上だけ。ファイルは保存時に補完済みの内容になる）。
+    readonly=True はコピーせず共有のスナップショットを返す（表示専用、変更禁止）。
+    """
+    with file_locks.hold(config_lock_key(guild_id)):
+        cfg = _load_guild_config(guild_id)
+    return cfg if readonly else copy.deepcopy(cfg)
+
+
+def _load_guild_config(guild_id):
+    key = str(guild_id)
     p = guild_config_path(guild_id)
-    p.parent.mkdir(parents=True, exist_ok=True)
+    sig = _file_sig(p)
+
+    ent = _CONFIG_CACHE.get(key)
+    if ent is not None and ent["sig"] == sig:
+        return ent["cfg"]
 
-    if not p.exists():
-        save_guild_config(guild_id, DEFAULT_GUILD_CONFIG)
-        return dict(DEFAULT_GUILD_CONFIG)
+    if sig is None:
+        # ファイルが無い間は既定値（保存されるまで作らない）
+        cfg = normalize_guild_config({})
+        _remember(key, cfg, None)
+        return cfg
 
     try:
         raw = p.read_text(encoding="utf-8").strip()
         data = json.loads(raw) if raw else {}
-        merged = deep_merge(DEFAULT_GUILD_CONFIG, data)
-
-        # panels最低1保証
-        panels = merged.get("ticket", {}).get("panels", [])
-        if not isinstance(panels, list) or len(panels) == 0:
-            merged["ticket"]["panels"] = list(DEFAULT_GUILD_CONFIG["ticket"]["panels"])
+        if not isinstance(data, dict):
+            raise ValueError("config root must be an object")
+    except Exception:
+        # ✅ 壊れていてもデフォルトで上書きしない（直前の正常な設定があればそれを使い続ける）
+        # 同じ壊れたファイルを毎回読み直さないよう、このsigで覚えておく
+        logger.exception("guild config broken: %s", p)
+        cfg = ent["cfg"] if ent is not None else normalize_guild_config({})
+        _remember(key, cfg, sig)
+        return cfg
 
-        # deployments型保証
-        for p2 in merged["ticket"]["panels"]:
-            if "deployments" not in p2 or not isinstance(p2["deployments"], list):
-                p2["deployments"] = []
+    merged = normalize_guild_config(data)
+    _remember(key, merged, sig)
+    return merged
 
-        save_guild_config(guild_id, merged)
-        return merged
-    except Exception:
-        save_guild_config(guild_id, DEFAULT_GUILD_CONFIG)
-        return dict(DEFAULT_GUILD_CONFIG)
 
 def save_guild_config(guild_id, cfg):
     p = guild_config_path(guild_id)
-    p.parent.mkdir(parents=True, exist_ok=True)
-    p.write_text(json.dumps(cfg, ensure_ascii=False, indent=2), encoding="utf-8")
+    cfg = normalize_guild_config(cfg)
+    with file_locks.hold(config_lock_key(guild_id)):
+        atomic_write_json(p, cfg, indent=2)
+        _remember(str(guild_id), cfg, _file_sig(p))
+
+
+def update_guild_config(guild_id, fn):
+    """
+    設定の 読み込み→fn(cfg)→保存 をロック内で行う（Webと同時に保存しても片方が消えない）。
+    fn は cfg を直接書き換える。fn の戻り値をそのまま返す。
+    """
+    with file_locks.hold(config_lock_key(guild_id)):
+        cfg = load_guild_config(guild_id)
+        ret = fn(cfg)
+        save_guild_config(guild_id, cfg)
+        return ret
+
+
+# -------------------------
+# async I/O（イベントループを止めない）
+# -------------------------
+IO_WORKERS = int(os.getenv("STORAGE_IO_WORKERS", "4"))
+_IO_POOL = None
+_IO_LOCKS = KeyedLocks(asyncio.Lock)  # 同じファイルへのI/Oは順番に（スレッドを待ちで埋めない）
+
+
+def _io_pool():
+    global _IO_POOL
+    if _IO_POOL is None:
+        _IO_POOL = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="storage-io")
+    return _IO_POOL
+
+
+async def run_io(key, fn, *args, **kwargs):
+    """
+    ブロッキングな fn をI/Oスレッドプールで実行する。
+    key（("tickets", gid) など、対象ファイルを表すタプル）が同じ呼び出しは直列化される。
+    """
+    async with _IO_LOCKS.ahold(key):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_io_pool(), functools.partial(fn, *args, **kwargs))
+
+
+async def aload_guild_config(guild_id, readonly=False):
+    return await run_io(config_lock_key(guild_id), load_guild_config, guild_id, readonly)
+
+
+async def asave_guild_config(guild_id, cfg):
+    await run_io(config_lock_key(guild_id), save_guild_config, guild_id, copy.deepcopy(cfg))
+
+
+async def aupdate_guild_config(guild_id, fn):
+    """update_guild_config の非同期版（fn はI/Oスレッドで呼ばれるので、同期で完結させること）"""
+    return await run_io(config_lock_key(guild_id), update_guild_config, guild_id, fn)
+
+
+async def abackend(key, method, *args):
+    """get_backend().method(*args) をI/Oスレッドで実行する"""
+    return await run_io(key, getattr(get_backend(), method), *args)
+
+
+# -------------------------
+# storage backends (tickets / ranking counters / stats)
+# -------------------------
+STATS_KEYS = ("messages", "joins", "leaves")
+
+
+def _empty_day():
+    return {k: 0 for k in STATS_KEYS}
+
+
+def rollup_stats(data, retention_days, today):
+    """retention_days より古い日別データを "monthly" の月次合計へ畳み込む"""
+    cutoff = (today - datetime.timedelta(days=retention_days)).isoformat()
+    monthly = data.get("monthly")
+    if not isinstance(monthly, dict):
+        monthly = {}
+
+    for day in [d for d in data.keys() if d != "monthly" and d < cutoff]:
+        row = data.pop(day)
+        if not isinstance(row, dict):
+            continue
+        m = monthly.setdefault(day[:7], _empty_day())
+        for k, v in row.items():
+            m[k] = int(m.get(k, 0)) + int(v or 0)
+
+    if monthly:
+        data["monthly"] = monthly
+    return data
+
+
+def _read_json(p, default):
+    """無ければ default。壊れていたら退避して default（退避しないと次の書き込みで消える）"""
+    try:
+        raw = p.read_text(encoding="utf-8").strip() if p.exists() else ""
+        return json.loads(raw) if raw else default
+    except Exception:
+        logger.exception("failed to read %s", p)
+        quarantine(p)
+        return default
+
+
+class JsonBackend:
+    """従来どおりのJSONファイル群（既定）"""
+
+    name = "json"
+
+    def __init__(self, root="data", coalesce_delay=0.5):
+        self.root = Path(root)
+        self._writer = CoalescingWriter(coalesce_delay)
+
+    def _read(self, p, default):
+        # まだ書き出していない最新の内容があればそちらを読む
+        text = self._writer.peek(p)
+        if text is not None:
+            return json.loads(text)
+        return _read_json(p, default)
+
+    def _write(self, p, data):
+        # データファイルはコンパクト形式（indent整形のCPUとサイズを省く）
+        self._writer.write(p, dump_json(data))
+
+    def flush(self):
+        self._writer.flush()
+
+    def _update(self, key, p, default, fn):
+        """読み込み→fn(data)→書き込み を key のロック内で（別スレッドの更新を取りこぼさない）"""
+        with file_locks.hold(key):
+            data = fn(self._read(p, default))
+            self._write(p, data)
+
+    # ---- tickets ----
+    def _tickets_path(self, guild_id):
+        return self.root / "tickets" / "{}.json".format(guild_id)
+
+    def load_tickets(self, guild_id):
+        data = self._read(self._tickets_path(guild_id), None)
+        if not isinstance(data, dict) or not isinstance(data.get("tickets"), list):
+            data = {"tickets": []}
+        if not isinstance(data.get("counters"), dict):
+            data["counters"] = {}
+        return data
+
+    def save_tickets(self, guild_id, store):
+        with file_locks.hold(("tickets", str(guild_id))):
+            self._write(self._tickets_path(guild_id), store)
+
+    def _update_tickets(self, guild_id, fn):
+        def _apply(data):
+            if not isinstance(data, dict) or not isinstance(data.get("tickets"), list):
+                data = {"tickets": []}
+            if not isinstance(data.get("counters"), dict):
+                data["counters"] = {}
+            fn(data)
+            return data
+        self._update(("tickets", str(guild_id)), self._tickets_path(guild_id), None, _apply)
+
+    def upsert_tickets(self, guild_id, tickets):
+        if not tickets:
+            return
+
+        def _apply(store):
+            pos = {t.get("ticket_id"): i for i, t in enumerate(store["tickets"])}
+            for ticket in tickets:
+                i = pos.get(ticket.get("ticket_id"))
+                if i is None:
+                    pos[ticket.get("ticket_id")] = len(store["tickets"])
+                    store["tickets"].append(ticket)
+                else:
+                    store["tickets"][i] = ticket
+        self._update_tickets(guild_id, _apply)
+
+    def upsert_ticket(self, guild_id, ticket):
+        self.upsert_tickets(guild_id, [ticket])
+
+    def set_ticket_counter(self, guild_id, name, value):
+        def _apply(store):
+            # 採番は増えるだけ（古い値で上書きしない）
+            cur = int(store["counters"].get(str(name), 0) or 0)
+            store["counters"][str(name)] = max(cur, int(value))
+        self._update_tickets(guild_id, _apply)
+
+    def delete_tickets(self, guild_id, ticket_ids):
+        ids = set(ticket_ids)
+        if not ids:
+            return
+
+        def _apply(store):
+            store["tickets"] = [t for t in store["tickets"] if t.get("ticket_id") not in ids]
+        self._update_tickets(guild_id, _apply)
+
+    # ---- ranking counters ({uid: int}) ----
+    def _counters_path(self, kind, guild_id):
+        return self.root / "ranking" / "{}_{}.json".format(kind, guild_id)
+
+    def load_counters(self, kind, guild_id):
+        data = self._read(self._counters_path(kind, guild_id), {})
+        if not isinstance(data, dict):
+            return {}
+        return {str(k): int(v or 0) for k, v in data.items()}
+
+    def write_counters(self, kind, guild_id, data, changed):
+        # JSONは部分更新できないので全体を書き出す
+        with file_locks.hold(("counters", kind, str(guild_id))):
+            self._write(self._counters_path(kind, guild_id), data)
+
+    # ---- last-seen names ({uid: 表示名}) ----
+    def _last_names_path(self, guild_id):
+        return self.root / "ranking" / "names_{}.json".format(guild_id)
+
+    def load_last_names(self, guild_id):
+        data = self._read(self._last_names_path(guild_id), {})
+        if not isinstance(data, dict):
+            return {}
+        return {str(k): str(v) for k, v in data.items() if v}
+
+    def save_last_names(self, guild_id, names):
+        with file_locks.hold(("last_names", str(guild_id))):
+            self._write(self._last_names_path(guild_id), names)
+
+    # ---- VC sessions checkpoint ({gid: {uid: epoch}}) ----
+    def _vc_sessions_path(self):
+        return self.root / "ranking" / "vc_sessions.json"
+
+    def load_vc_sessions(self):
+        data = self._read(self._vc_sessions_path(), {})
+        return data if isinstance(data, dict) else {}
+
+    def save_vc_sessions(self, sessions):
+        self._write(self._vc_sessions_path(), sessions)
+
+    # ---- stats ----
+    def _stats_path(self, guild_id):
+        return self.root / "stats" / "{}.json".format(guild_id)
+
+    def load_stats(self, guild_id):
+        data = self._read(self._stats_path(guild_id), {})
+        return data if isinstance(data, dict) else {}
+
+    def add_stats(self, guild_id, deltas, retention_days, today):
+        def _apply(data):
+            if not isinstance(data, dict):
+                data = {}
+            for day, row in deltas.items():
+                cur = data.setdefault(day, _empty_day())
+                for k, v in row.items():
+                    cur[k] = int(cur.get(k, 0)) + v
+            rollup_stats(data, retention_days, today)
+            return data
+        self._update(("stats", str(guild_id)), self._stats_path(guild_id), {}, _apply)
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tickets (
+    guild_id    TEXT NOT NULL,
+    ticket_id   TEXT NOT NULL,
+    panel_index INTEGER,
+    user_id     TEXT,
+    status      TEXT,
+    channel_id  TEXT,
+    thread_id   TEXT,
+    created_at  TEXT,
+    data        TEXT NOT NULL,
+    PRIMARY KEY (guild_id, ticket_id)
+);
+-- チケットはギルド単位でまとめて読み、検索はメモリ上の索引で行うので主キー以外の索引は持たない
+DROP INDEX IF EXISTS idx_tickets_channel;
+DROP INDEX IF EXISTS idx_tickets_thread;
+DROP INDEX IF EXISTS idx_tickets_user;
+
+CREATE TABLE IF NOT EXISTS ticket_counters (
+    guild_id TEXT NOT NULL,
+    name     TEXT NOT NULL,
+    value    INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, name)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS counters (
+    kind     TEXT NOT NULL,
+    guild_id TEXT NOT NULL,
+    user_id  TEXT NOT NULL,
+    value    INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (kind, guild_id, user_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS last_names (
+    guild_id TEXT NOT NULL,
+    user_id  TEXT NOT NULL,
+    name     TEXT NOT NULL,
+    PRIMARY KEY (guild_id, user_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS vc_sessions (
+    guild_id TEXT NOT NULL,
+    user_id  TEXT NOT NULL,
+    last_ts  REAL NOT NULL,
+    PRIMARY KEY (guild_id, user_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS stats_daily (
+    guild_id TEXT NOT NULL,
+    day      TEXT NOT NULL,
+    messages INTEGER NOT NULL DEFAULT 0,
+    joins    INTEGER NOT NULL DEFAULT 0,
+    leaves   INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, day)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS stats_monthly (
+    guild_id TEXT NOT NULL,
+    month    TEXT NOT NULL,
+    messages INTEGER NOT NULL DEFAULT 0,
+    joins    INTEGER NOT NULL DEFAULT 0,
+    leaves   INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, month)
+) WITHOUT ROWID;
+"""
+
+
+def _opt_str(v):
+    return None if v in (None, "") else str(v)
+
+
+class SqliteBackend:
+    """
+    組み込みSQLite（WALモード）。1行単位のupsertと、1呼び出し=1トランザクションのバッチ書き込み。
+    統計のflushはワーカースレッドから呼ばれるので接続はロックで直列化する。
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path="data/kamosaba.db"):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SQLITE_SCHEMA)
+        self._conn.commit()
+
+    def flush(self):
+        pass  # 各呼び出しがトランザクションで確定済み
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ---- tickets ----
+    @staticmethod
+    def _ticket_row(guild_id, t):
+        return (
+            str(guild_id), str(t.get("ticket_id")), int(t.get("panel_index", 0)),
+            _opt_str(t.get("user_id")), t.get("status"),
+            _opt_str(t.get("channel_id")), _opt_str(t.get("thread_id")),
+            t.get("created_at"), json.dumps(t, ensure_ascii=False),
+        )
+
+    _UPSERT_TICKET = """
+        INSERT INTO tickets (guild_id, ticket_id, panel_index, user_id, status, channel_id, thread_id, created_at, data)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (guild_id, ticket_id) DO UPDATE SET
+            panel_index = excluded.panel_index, user_id = excluded.user_id, status = excluded.status,
+            channel_id = excluded.channel_id, thread_id = excluded.thread_id,
+            created_at = excluded.created_at, data = excluded.data
+    """
+
+    def load_tickets(self, guild_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM tickets WHERE guild_id = ? ORDER BY rowid", (str(guild_id),)
+            ).fetchall()
+            counters = self._conn.execute(
+                "SELECT name, value FROM ticket_counters WHERE guild_id = ?", (str(guild_id),)
+            ).fetchall()
+        return {"tickets": [json.loads(r[0]) for r in rows], "counters": {n: v for n, v in counters}}
+
+    def save_tickets(self, guild_id, store):
+        gid = str(guild_id)
+        tickets = store.get("tickets", [])
+        with self._lock, self._conn:
+            ids = [str(t.get("ticket_id")) for t in tickets]
+            self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS _keep (ticket_id TEXT PRIMARY KEY)")
+            self._conn.execute("DELETE FROM _keep")
+            self._conn.executemany("INSERT OR IGNORE INTO _keep VALUES (?)", [(i,) for i in ids])
+            self._conn.execute(
+                "DELETE FROM tickets WHERE guild_id = ? AND ticket_id NOT IN (SELECT ticket_id FROM _keep)", (gid,)
+            )
+            self._conn.executemany(self._UPSERT_TICKET, [self._ticket_row(gid, t) for t in tickets])
+            self._conn.execute("DELETE FROM ticket_counters WHERE guild_id = ?", (gid,))
+            self._conn.executemany(
+                "INSERT INTO ticket_counters (guild_id, name, value) VALUES (?, ?, ?)",
+                [(gid, str(k), int(v)) for k, v in (store.get("counters") or {}).items()],
+            )
+
+    def upsert_tickets(self, guild_id, tickets):
+        if not tickets:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(self._UPSERT_TICKET, [self._ticket_row(guild_id, t) for t in tickets])
+
+    def upsert_ticket(self, guild_id, ticket):
+        self.upsert_tickets(guild_id, [ticket])
+
+    def set_ticket_counter(self, guild_id, name, value):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO ticket_counters (guild_id, name, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (guild_id, name) DO UPDATE SET value = MAX(value, excluded.value)",
+                (str(guild_id), str(name), int(value)),
+            )
+
+    def delete_tickets(self, guild_id, ticket_ids):
+        ids = [(str(guild_id), str(i)) for i in ticket_ids]
+        if not ids:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM tickets WHERE guild_id = ? AND ticket_id = ?", ids)
+
+    # ---- ranking counters ----
+    def load_counters(self, kind, guild_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT user_id, value FROM counters WHERE kind = ? AND guild_id = ?", (kind, str(guild_id))
+            ).fetchall()
+        return {u: int(v) for u, v in rows}
+
+    def write_counters(self, kind, guild_id, data, changed):
+        gid = str(guild_id)
+        rows = [(kind, gid, str(uid), int(data.get(uid, 0))) for uid in changed]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO counters (kind, guild_id, user_id, value) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (kind, guild_id, user_id) DO UPDATE SET value = excluded.value",
+                rows,
+            )
+
+    # ---- last-seen names ----
+    def load_last_names(self, guild_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT user_id, name FROM last_names WHERE guild_id = ?", (str(guild_id),)
+            ).fetchall()
+        return {u: n for u, n in rows}
+
+    def save_last_names(self, guild_id, names):
+        gid = str(guild_id)
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM last_names WHERE guild_id = ?", (gid,))
+            self._conn.executemany(
+                "INSERT INTO last_names (guild_id, user_id, name) VALUES (?, ?, ?)",
+                [(gid, str(u), str(n)) for u, n in names.items() if n],
+            )
+
+    # ---- VC sessions checkpoint ----
+    def load_vc_sessions(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT guild_id, user_id, last_ts FROM vc_sessions").fetchall()
+        out = {}
+        for gid, uid, ts in rows:
+            out.setdefault(gid, {})[uid] = ts
+        return out
+
+    def save_vc_sessions(self, sessions):
+        rows = [(str(g), str(u), float(ts)) for g, users in sessions.items() for u, ts in users.items()]
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM vc_sessions")
+            self._conn.executemany("INSERT INTO vc_sessions (guild_id, user_id, last_ts) VALUES (?, ?, ?)", rows)
+
+    # ---- stats ----
+    def load_stats(self, guild_id):
+        gid = str(guild_id)
+        with self._lock:
+            days = self._conn.execute(
+                "SELECT day, messages, joins, leaves FROM stats_daily WHERE guild_id = ?", (gid,)
+            ).fetchall()
+            months = self._conn.execute(
+                "SELECT month, messages, joins, leaves FROM stats_monthly WHERE guild_id = ?", (gid,)
+            ).fetchall()
+        out = {d: dict(zip(STATS_KEYS, vals)) for d, *vals in days}
+        if months:
+            out["monthly"] = {m: dict(zip(STATS_KEYS, vals)) for m, *vals in months}
+        return out
+
+    def add_stats(self, guild_id, deltas, retention_days, today):
+        gid = str(guild_id)
+        rows = [
+            (gid, day, int(row.get("messages", 0)), int(row.get("joins", 0)), int(row.get("leaves", 0)))
+            for day, row in deltas.items()
+        ]
+        cutoff = (today - datetime.timedelta(days=retention_days)).isoformat()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO stats_daily (guild_id, day, messages, joins, leaves) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (guild_id, day) DO UPDATE SET messages = messages + excluded.messages, "
+                "joins = joins + excluded.joins, leaves = leaves + excluded.leaves",
+                rows,
+            )
+            # 古い日別データを月次へ
+            self._conn.execute(
+                "INSERT INTO stats_monthly (guild_id, month, messages, joins, leaves) "
+                "SELECT guild_id, substr(day, 1, 7), SUM(messages), SUM(joins), SUM(leaves) "
+                "FROM stats_daily WHERE guild_id = ? AND day < ? GROUP BY substr(day, 1, 7) "
+                "ON CONFLICT (guild_id, month) DO UPDATE SET messages = messages + excluded.messages, "
+                "joins = joins + excluded.joins, leaves = leaves + excluded.leaves",
+                (gid, cutoff),
+            )
+            self._conn.execute("DELETE FROM stats_daily WHERE guild_id = ? AND day < ?", (gid, cutoff))
+
+    def import_stats(self, guild_id, data):
+        """JSON形式の統計（日別 + "monthly"）でギルド分を置き換える（移行用）"""
+        gid = str(guild_id)
+
+        def _row(key, r):
+            return (gid, key, int(r.get("messages", 0)), int(r.get("joins", 0)), int(r.get("leaves", 0)))
+
+        monthly = data.get("monthly") or {}
+        days = [_row(d, r) for d, r in data.items() if d != "monthly" and isinstance(r, dict)]
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM stats_daily WHERE guild_id = ?", (gid,))
+            self._conn.execute("DELETE FROM stats_monthly WHERE guild_id = ?", (gid,))
+            self._conn.executemany(
+                "INSERT INTO stats_daily (guild_id, day, messages, joins, leaves) VALUES (?, ?, ?, ?, ?)", days
+            )
+            self._conn.executemany(
+                "INSERT INTO stats_monthly (guild_id, month, messages, joins, leaves) VALUES (?, ?, ?, ?, ?)",
+                [_row(m, r) for m, r in monthly.items() if isinstance(r, dict)],
+            )
+
+
+_BACKEND = None
+
+
+def get_backend():
+    """STORAGE_BACKEND=json|sqlite（既定json）。SQLITE_PATHでDBファイルを指定。"""
+    global _BACKEND
+    if _BACKEND is None:
+        kind = os.getenv("STORAGE_BACKEND", "json").strip().lower()
+        if kind == "sqlite":
+            _BACKEND = SqliteBackend(os.getenv("SQLITE_PATH", "data/kamosaba.db"))
+        else:
+            _BACKEND = JsonBackend()
+        logger.info("storage backend: %s", _BACKEND.name)
+    return _BACKEND
+
+
+# -------------------------
+# write-behind counters
+# -------------------------
+class CounterStore:
+    """
+    {uid: int} のカウンタをギルド単位でメモリに保持し、加算はメモリだけで行う。
+    flush() で変更のあったユーザー分だけをバックエンドへ書き出す（書き込みの償却）。
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self._data = {}   # gid(str) -> {uid(str): int}
+        self._dirty = {}  # gid(str) -> {uid(str)} 未書き出し
+        self.pending = 0  # 前回flush以降の加算回数
+
+    def _io_key(self, key):
+        return ("counters", self.kind, key)
+
+    def get(self, guild_id):
+        """ギルドのカウンタ全体（読み取り専用として扱うこと）。未ロードなら同期で読む"""
+        key = str(guild_id)
+        d = self._data.get(key)
+        if d is None:
+            d = get_backend().load_counters(self.kind, key)
+            self._data[key] = d
+        return d
+
+    async def aget(self, guild_id):
+        """get() の非同期版（初回の読み込みをI/Oスレッドで行う）"""
+        key = str(guild_id)
+        d = self._data.get(key)
+        if d is None:
+            loaded = await run_io(self._io_key(key), get_backend().load_counters, self.kind, key)
+            d = self._data.setdefault(key, loaded)
+        return d
+
+    def incr(self, guild_id, user_id, n=1):
+        d = self.get(guild_id)
+        uid = str(user_id)
+        d[uid] = d.get(uid, 0) + int(n)
+        self._dirty.setdefault(str(guild_id), set()).add(uid)
+        self.pending += 1
+        return d[uid]
+
+    def _take_dirty(self, guild_id):
+        keys = [str(guild_id)] if guild_id is not None else list(self._dirty)
+        out = []
+        for key in keys:
+            changed = self._dirty.pop(key, None)
+            if changed:
+                # スレッド側で書く間に加算されても壊れないようスナップショットを渡す
+                out.append((key, dict(self._data.get(key, {})), changed))
+        if not self._dirty:
+            self.pending = 0
+        return out
+
+    def _restore(self, key, changed):
+        # 失敗した分は次回また書く（pending も書けなかった人数分だけ戻す）
+        self._dirty.setdefault(key, set()).update(changed)
+        self.pending += len(changed)
+
+    def flush(self, guild_id=None):
+        """同期版（終了時用）。失敗したギルドがあっても残りは書き、最初のエラーを最後に投げる"""
+        backend = get_backend()
+        error = None
+        for key, data, changed in self._take_dirty(guild_id):
+            try:
+                backend.write_counters(self.kind, key, data, changed)
+            except Exception as e:
+                self._restore(key, changed)
+                error = error or e
+        if error is not None:
+            raise error
+
+    async def aflush(self, guild_id=None):
+        """flush() の非同期版（ギルドごとにI/Oスレッドで書く）"""
+        pending = self._take_dirty(guild_id)
+        error = None
+        for i, (key, data, changed) in enumerate(pending):
+            try:
+                await run_io(self._io_key(key), get_backend().write_counters, self.kind, key, data, changed)
+            except Exception as e:
+                self._restore(key, changed)
+                error = error or e
+            except BaseException:
+                for k, _, c in pending[i:]:
+                    self._restore(k, c)
+                raise
+        if error is not None:
+            raise error
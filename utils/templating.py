@@ -0,0 +1,105 @@
+import functools
+import re
+
+_VAR = re.compile(r"\{(\w+)\}")
+
+
+class Template:
+    """
+    {var} 形式のテンプレート。解析は1回だけで、描画は1パス。
+    未知の変数は {var} のまま残す。値の中の {..} は再展開しない。
+    """
+
+    __slots__ = ("source", "names", "_parts")
+
+    def __init__(self, source):
+        self.source = source
+        parts = []  # 偶数番目: 固定文字列 / 奇数番目: 変数名
+        pos = 0
+        for m in _VAR.finditer(source):
+            parts.append(source[pos:m.start()])
+            parts.append(m.group(1))
+            pos = m.end()
+        parts.append(source[pos:])
+        self._parts = tuple(parts)
+        self.names = frozenset(parts[1::2])
+
+    def render(self, mapping):
+        parts = self._parts
+        if len(parts) == 1:
+            return parts[0]
+        out = [parts[0]]
+        for i in range(1, len(parts), 2):
+            k = parts[i]
+            out.append(str(mapping[k]) if k in mapping else "{" + k + "}")
+            out.append(parts[i + 1])
+        return "".join(out)
+
+
+@functools.lru_cache(maxsize=2048)
+def compile_template(source):
+    return Template(source)
+
+
+def render(source, mapping):
+    """テンプレート文字列をその場で描画（解析結果は文字列ごとにキャッシュ）"""
+    return compile_template(str(source or "")).render(mapping)
+
+
+class EmbedTemplate:
+    """
+    Embed の設定を1回だけ解析しておき、描画時は変数の差し込みだけを行う。
+    build() は discord.Embed.from_dict() にそのまま渡せる dict を返す。
+    fields: [(name, value, inline)]、thumbnail: URLのテンプレート
+    """
+
+    def __init__(self, title="", description="", color=None, fields=(), footer="", thumbnail=""):
+        self.title = compile_template(str(title or ""))
+        self.description = compile_template(str(description or ""))
+        self.color = color
+        self.fields = [
+            (compile_template(str(n or "")), compile_template(str(v or "")), bool(inline))
+            for n, v, inline in fields
+        ]
+        self.footer = compile_template(str(footer or "").strip())
+        self.thumbnail = compile_template(str(thumbnail or ""))
+
+    def build(self, mapping):
+        d = {
+            "type": "rich",
+            "title": self.title.render(mapping),
+            "description": self.description.render(mapping),
+        }
+        if self.color is not None:
+            d["color"] = self.color
+        if self.fields:
+            d["fields"] = [
+                {"name": n.render(mapping), "value": v.render(mapping), "inline": inline}
+                for n, v, inline in self.fields
+            ]
+        if self.footer.source:
+            d["footer"] = {"text": self.footer.render(mapping)}
+        if self.thumbnail.source:
+            url = self.thumbnail.render(mapping)
+            if url:
+                d["thumbnail"] = {"url": url}
+        return d
+
+
+class TemplateCache:
+    """
+    (guild_id, name) -> 構築済みテンプレート。
+    設定バージョン（utils.storage.guild_config_version）が変わった時だけ factory() で作り直す。
+    """
+
+    def __init__(self):
+        self._items = {}  # (gid, name) -> (version, template)
+
+    def get(self, guild_id, name, version, factory):
+        key = (str(guild_id), name)
+        ent = self._items.get(key)
+        if ent is None or ent[0] != version:
+            ent = (version, factory())
+            self._items[key] = ent
+        return ent[1]
+
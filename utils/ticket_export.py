@@ -0,0 +1,214 @@
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import ticket_logs, transcript
+
+logger = logging.getLogger("TicketExport")
+
+# 同時に作れるアーカイブの数（それ以上は順番待ち）と、1回で出せるチケット数の上限
+EXPORT_WORKERS = int(os.getenv("TICKET_EXPORT_WORKERS", "2"))
+EXPORT_MAX_TICKETS = int(os.getenv("TICKET_EXPORT_MAX", "5000"))
+
+# format -> (Content-Type, 拡張子)
+FORMATS = {
+    "zip": ("application/zip", ".zip"),
+    "tar.gz": ("application/gzip", ".tar.gz"),
+}
+
+MANIFEST_FIELDS = ("ticket_id", "file", "user_id", "user_name", "panel_index", "status",
+                   "urgency", "created_at", "closed_at")
+
+# tar はサイズが先に要るので、一度ここに書く（これを超えたらディスクへ）
+SPOOL_SIZE = 4 * 1024 * 1024
+# イベントループ側に溜めておく未送信チャンクの数
+PIPE_DEPTH = 8
+
+_EOF = object()
+_POOL = None
+
+
+def _pool():
+    global _POOL
+    if _POOL is None:
+        _POOL = ThreadPoolExecutor(max_workers=max(1, EXPORT_WORKERS), thread_name_prefix="ticket-export")
+    return _POOL
+
+
+class _Pipe(io.RawIOBase):
+    """
+    ワーカースレッドで書いたバイト列をイベントループ側へ渡す。
+    未送信が PIPE_DEPTH 個たまったら書き込み側を待たせる（アーカイブ全体をメモリに持たない）。
+    """
+
+    def __init__(self, loop):
+        super().__init__()
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._slots = threading.Semaphore(PIPE_DEPTH)
+        self._aborted = False
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        if self._aborted:
+            raise BrokenPipeError("export aborted")
+        self._slots.acquire()
+        if self._aborted:
+            raise BrokenPipeError("export aborted")
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, bytes(b))
+        return len(b)
+
+    def finish(self, exc=None):
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, exc if exc is not None else _EOF)
+
+    def abort(self):
+        # 待っている書き込みを起こして BrokenPipeError で終わらせる
+        self._aborted = True
+        self._slots.release()
+
+    async def get(self):
+        item = await self._queue.get()
+        if isinstance(item, bytes):
+            self._slots.release()
+        return item
+
+
+def _read_file(path, size=transcript.CHUNK_SIZE):
+    with open(path, "rb") as f:
+        while True:
+            b = f.read(size)
+            if not b:
+                return
+            yield b
+
+
+def _transcript_chunks(guild_id, guild_name, ticket, names_fn):
+    """1件分のHTML（bytes のチャンク）。クローズ済みは描画済みファイルを使う（無ければ作る）"""
+    tid = ticket["ticket_id"]
+    closed = ticket.get("status") == "closed"
+    if closed and ticket_logs.rendered_is_fresh(guild_id, tid):
+        return _read_file(ticket_logs.rendered_path(guild_id, tid))
+
+    # メッセージは .jsonl から少しずつ読み、表示名もその単位で引く
+    detail = ticket_logs.load_detail(guild_id, tid)
+    chunks = transcript.iter_html(guild_name, ticket, detail, names_fn)
+    if closed:
+        return _read_file(transcript.write_cached(ticket_logs.rendered_path(guild_id, tid), chunks))
+    return transcript.iter_bytes(chunks)
+
+
+def _manifest(rows):
+    buf = io.StringIO()
+    w = csv.DictWriter(buf, fieldnames=MANIFEST_FIELDS, extrasaction="ignore")
+    w.writeheader()
+    w.writerows(rows)
+    return (json.dumps(rows, ensure_ascii=False, indent=2).encode("utf-8"),
+            buf.getvalue().encode("utf-8-sig"))  # Excel で文字化けしないようにBOM付き
+
+
+def _tar_add(tf, name, fileobj, size):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(time.time())
+    tf.addfile(info, fileobj)
+
+
+def _build(out, fmt, guild_id, guild_name, entries, names_fn):
+    creators = names_fn([t.get("user_id") for t in entries if t.get("user_id")]) or {}
+    rows = []
+
+    def _row(t, name):
+        uid = str(t.get("user_id") or "")
+        return {
+            "ticket_id": str(t["ticket_id"]),
+            "file": name,
+            "user_id": uid,
+            "user_name": creators.get(uid) or "",
+            "panel_index": t.get("panel_index", ""),
+            "status": t.get("status") or "",
+            "urgency": t.get("urgency") or "",
+            "created_at": t.get("created_at") or "",
+            "closed_at": t.get("closed_at") or "",
+        }
+
+    if fmt == "zip":
+        with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for t in entries:
+                name = "transcripts/ticket_{}.html".format(t["ticket_id"])
+                with zf.open(name, "w") as f:
+                    for b in _transcript_chunks(guild_id, guild_name, t, names_fn):
+                        f.write(b)
+                rows.append(_row(t, name))
+            mj, mc = _manifest(rows)
+            zf.writestr("manifest.json", mj)
+            zf.writestr("manifest.csv", mc)
+    else:
+        with tarfile.open(fileobj=out, mode="w|gz") as tf:
+            for t in entries:
+                name = "transcripts/ticket_{}.html".format(t["ticket_id"])
+                with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as tmp:
+                    for b in _transcript_chunks(guild_id, guild_name, t, names_fn):
+                        tmp.write(b)
+                    size = tmp.tell()
+                    tmp.seek(0)
+                    _tar_add(tf, name, tmp, size)
+                rows.append(_row(t, name))
+            for name, data in zip(("manifest.json", "manifest.csv"), _manifest(rows)):
+                _tar_add(tf, name, io.BytesIO(data), len(data))
+    out.flush()
+
+
+def _run(pipe, fmt, guild_id, guild_name, entries, names_fn):
+    exc = None
+    try:
+        _build(io.BufferedWriter(pipe, buffer_size=transcript.CHUNK_SIZE),
+               fmt, guild_id, guild_name, entries, names_fn)
+    except BrokenPipeError:
+        pass  # 相手が切断した
+    except Exception as e:
+        logger.exception("ticket export failed: guild=%s", guild_id)
+        exc = e
+    finally:
+        pipe.finish(exc)
+
+
+async def stream(write, fmt, guild_id, guild_name, entries, resolve_names=None):
+    """
+    entries のトランスクリプトとマニフェストを fmt（FORMATS のキー）のアーカイブにして、
+    できた分から await write(bytes) で送る。描画と圧縮はエクスポート用スレッドで行う。
+    resolve_names: async (ids) -> {uid: 表示名}（スレッドからイベントループ上で呼ぶ）
+    """
+    loop = asyncio.get_running_loop()
+
+    def names_fn(ids):
+        if resolve_names is None or not ids:
+            return {}
+        return asyncio.run_coroutine_threadsafe(resolve_names(ids), loop).result(timeout=60)
+
+    pipe = _Pipe(loop)
+    fut = loop.run_in_executor(_pool(), _run, pipe, fmt, guild_id, guild_name, list(entries), names_fn)
+    try:
+        while True:
+            item = await pipe.get()
+            if item is _EOF:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            await write(item)
+    except BaseException:
+        pipe.abort()
+        raise
+    finally:
+        # スレッドが終わるまで待つ（abort 済みならすぐ抜ける）
+        await asyncio.shield(fut)
@@ -0,0 +1,356 @@
+import bisect
+import itertools
+import json
+import logging
+import re
+import threading
+from pathlib import Path
+
+from utils.storage import atomic_write_json, file_locks
+
+logger = logging.getLogger("TicketLogs")
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# index の追記ログがこの大きさを超えたら index.json にまとめる（bytes）
+INDEX_LOG_COMPACT_BYTES = 256 * 1024
+
+_TICKET_ID = re.compile(r"[\w-]+")
+
+
+def ticket_dir(guild_id):
+    return Path("data/tickets/{}".format(guild_id))
+
+
+def index_path(guild_id):
+    return ticket_dir(guild_id) / "index.json"
+
+
+def index_log_path(guild_id):
+    """index の変更（作成/クローズ）を1行ずつ追記するログ。index.json + このログ = 最新の一覧"""
+    return ticket_dir(guild_id) / "index.log.jsonl"
+
+
+def detail_path(guild_id, ticket_id):
+    """URLから来た ticket_id でも data/tickets/{gid} の外を指さないようにする"""
+    if not _TICKET_ID.fullmatch(str(ticket_id)):
+        return None
+    return ticket_dir(guild_id) / "{}.json".format(ticket_id)
+
+
+def messages_path(guild_id, ticket_id):
+    """TicketSystem が追記するメッセージログ（1行1メッセージの JSON Lines）"""
+    p = detail_path(guild_id, ticket_id)
+    return p.with_suffix(".jsonl") if p is not None else None
+
+
+def _sig(p):
+    try:
+        st = p.stat()
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+def _sort_key(t):
+    return (str(t.get("created_at") or ""), str(t.get("ticket_id")))
+
+
+def _merge_records(items, records):
+    """records（ticket_id 付きの部分更新）を items に反映する。既存は上書き、無ければ末尾に追加"""
+    pos = {str(t.get("ticket_id")): i for i, t in enumerate(items) if isinstance(t, dict)}
+    for r in records:
+        tid = str(r["ticket_id"])
+        i = pos.get(tid)
+        if i is None:
+            pos[tid] = len(items)
+            items.append(dict(r))
+        else:
+            merged = dict(items[i])
+            merged.update(r)
+            items[i] = merged
+    return items
+
+
+class TicketIndex:
+    """
+    チケット一覧を作成日時順に並べたもの（古い→新しい）と ticket_id -> 位置 の対応。
+    - 1件の参照は O(1)（pos）
+    - ページングは直前ページ最後の ticket_id をカーソルにして、その位置から新しい順に読む
+    - 期間の上限は bisect、ユーザー指定はユーザー別の位置リストから読むので全件は舐めない
+    """
+
+    def __init__(self, entries):
+        items = [t for t in entries if isinstance(t, dict) and t.get("ticket_id")]
+        # 追記順（=作成順）で書かれていればほぼ整列済みなので安い
+        items.sort(key=_sort_key)
+        self.items = items
+        self._created = [str(t.get("created_at") or "") for t in items]
+        self.pos = {}
+        self._by_user = {}
+        for i, t in enumerate(items):
+            self.pos[str(t["ticket_id"])] = i
+            uid = t.get("user_id")
+            if uid:
+                self._by_user.setdefault(str(uid), []).append(i)
+
+    def __len__(self):
+        return len(self.items)
+
+    def applied(self, records):
+        """
+        records を反映した新しい索引（自分は変更しない。読み込み中の画面があっても壊れない）。
+        作成順の追記と既存の更新だけなら、パースも並べ直しもしない。
+        """
+        new = TicketIndex.__new__(TicketIndex)
+        new.items = list(self.items)
+        new._created = list(self._created)
+        new.pos = dict(self.pos)
+        new._by_user = dict(self._by_user)  # 中のリストは追加する時に作り直す
+        for r in records:
+            tid = str(r["ticket_id"])
+            i = new.pos.get(tid)
+            if i is not None:
+                merged = dict(new.items[i])
+                merged.update(r)
+                if _sort_key(merged) != _sort_key(new.items[i]):
+                    return TicketIndex(_merge_records(list(self.items), records))
+                new.items[i] = merged
+                continue
+            e = dict(r)
+            if new.items and _sort_key(e) < _sort_key(new.items[-1]):
+                return TicketIndex(_merge_records(list(self.items), records))
+            i = len(new.items)
+            new.items.append(e)
+            new._created.append(str(e.get("created_at") or ""))
+            new.pos[tid] = i
+            uid = e.get("user_id")
+            if uid:
+                new._by_user[str(uid)] = new._by_user.get(str(uid), []) + [i]
+        return new
+
+    def get(self, ticket_id):
+        i = self.pos.get(str(ticket_id))
+        return self.items[i] if i is not None else None
+
+    def _scan(self, cursor="", status="", panel="", user="", urgency="", since="", until=""):
+        """条件に合うエントリを新しい順に返す"""
+        start = len(self.items) - 1
+        if cursor:
+            p = self.pos.get(str(cursor))
+            if p is not None:
+                start = p - 1
+        if until:
+            start = min(start, bisect.bisect_right(self._created, until + "\uffff") - 1)
+
+        if user:
+            plist = self._by_user.get(str(user), [])
+            k = bisect.bisect_right(plist, start)
+            candidates = (plist[j] for j in range(k - 1, -1, -1))
+        else:
+            candidates = range(start, -1, -1)
+
+        for i in candidates:
+            if since and self._created[i] < since:
+                return
+            t = self.items[i]
+            if status and str(t.get("status") or "") != status:
+                continue
+            if panel != "" and str(t.get("panel_index", "")) != str(panel):
+                continue
+            if urgency and str(t.get("urgency") or "") != urgency:
+                continue
+            yield t
+
+    def page(self, cursor="", limit=PAGE_SIZE, **filters):
+        """
+        新しい順に最大 limit 件。戻り値は (items, next_cursor)。next_cursor が None なら最後のページ。
+        filters: status / panel / user / urgency / since / until（"YYYY-MM-DD"、created_at と同じUTC）
+        """
+        limit = max(1, min(MAX_PAGE_SIZE, int(limit)))
+        out = list(itertools.islice(self._scan(cursor, **filters), limit + 1))
+        if len(out) > limit:
+            out = out[:limit]
+            return out, str(out[-1]["ticket_id"])
+        return out, None
+
+    def select(self, limit, **filters):
+        """条件に合うものを新しい順に最大 limit 件（一括エクスポート用）"""
+        return list(itertools.islice(self._scan(**filters), max(0, int(limit))))
+
+
+def _read_snapshot(p):
+    if not p.exists():
+        return []
+    try:
+        raw = p.read_text(encoding="utf-8").strip()
+        data = json.loads(raw) if raw else []
+    except Exception:
+        logger.exception("failed to read %s", p)
+        return []
+    return data if isinstance(data, list) else []
+
+
+def _read_log(p, offset=0):
+    """offset 以降の完結した行を読む。戻り値は (records, 次に読む位置)"""
+    try:
+        with open(p, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [], offset
+    end = data.rfind(b"\n") + 1  # 書きかけの行は次回
+    records = []
+    for line in data[:end].splitlines():
+        try:
+            r = json.loads(line)
+        except ValueError:
+            continue  # 落ちた時の書きかけの行
+        if isinstance(r, dict) and r.get("ticket_id"):
+            records.append(r)
+    return records, offset + end
+
+
+# gid(str) -> (index.json のシグネチャ, TicketIndex, 追記ログの読んだ位置)
+_INDEX_CACHE = {}
+_INDEX_LOCK = threading.Lock()
+
+
+def load_index(guild_id):
+    """
+    index.json + 追記ログ。index.json が変わった時（まとめ直し）だけ全体を読み直し、
+    それ以外は追記ログの増えた分だけを反映する（同期I/O。イベントループからは run_io 経由で）
+    """
+    p = index_path(guild_id)
+    lp = index_log_path(guild_id)
+    sig = _sig(p)
+    log_sig = _sig(lp)
+    log_size = log_sig[1] if log_sig is not None else 0
+    key = str(guild_id)
+    with _INDEX_LOCK:
+        ent = _INDEX_CACHE.get(key)
+
+    if ent is not None and ent[0] == sig and log_size >= ent[2]:
+        index, offset = ent[1], ent[2]
+        if log_size == offset:
+            return index
+        records, offset = _read_log(lp, offset)
+        if records:
+            index = index.applied(records)
+    else:
+        records, offset = _read_log(lp)
+        index = TicketIndex(_merge_records(_read_snapshot(p), records))
+
+    with _INDEX_LOCK:
+        _INDEX_CACHE[key] = (sig, index, offset)
+    return index
+
+
+def _iter_messages(p):
+    """JSON Lines を1行ずつ読む（全体をリストにしない）。落ちた時の書きかけの行などは飛ばす"""
+    try:
+        f = open(p, encoding="utf-8")
+    except OSError:
+        logger.exception("failed to read %s", p)
+        return
+    with f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                m = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(m, dict):
+                yield m
+
+
+def load_detail(guild_id, ticket_id):
+    """
+    {ticket_id}.json（旧形式/手動で置いたもの）と {ticket_id}.jsonl（TicketSystem の記録）を合わせて返す。
+    どちらも無ければ None。
+    messages は旧形式の分 → .jsonl の分 を順に返すイテレータ（1回だけ読める。.jsonl は読んだ分だけメモリに載る）。
+    """
+    p = detail_path(guild_id, ticket_id)
+    if p is None:
+        return None
+    data = None
+    if p.exists():
+        try:
+            data = json.loads(p.read_text(encoding="utf-8") or "{}")
+        except Exception:
+            data = None
+        if not isinstance(data, dict):
+            data = None
+
+    mp = messages_path(guild_id, ticket_id)
+    if mp.exists():
+        data = data or {"ticket_id": str(ticket_id)}
+        data["messages"] = itertools.chain(data.get("messages") or [], _iter_messages(mp))
+    return data
+
+
+def append_messages(guild_id, ticket_id, rows):
+    """メッセージをまとめて追記する（同期I/O。ギルド単位で順番に呼ぶこと）"""
+    mp = messages_path(guild_id, ticket_id)
+    if mp is None or not rows:
+        return
+    _append_lines(mp, rows)
+
+
+def _append_lines(p, rows):
+    p.parent.mkdir(parents=True, exist_ok=True)
+    text = "".join(json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n" for r in rows)
+    with open(p, "a+b") as f:
+        # 前回が書きかけの行で終わっていたら改行を足す（その行だけを捨てて、次の行は壊さない）
+        if f.seek(0, 2) > 0:
+            f.seek(-1, 2)
+            if f.read(1) != b"\n":
+                text = "\n" + text
+        f.write(text.encode("utf-8"))
+
+
+def upsert_index(guild_id, entry):
+    """
+    一覧の1件分の変更を追記ログに1行足す（index.json は書き換えない）。
+    ログが INDEX_LOG_COMPACT_BYTES を超えたら index.json にまとめる。
+    """
+    lp = index_log_path(guild_id)
+    with file_locks.hold(("ticket_index", str(guild_id))):
+        _append_lines(lp, [dict(entry, ticket_id=str(entry["ticket_id"]))])
+        if lp.stat().st_size >= INDEX_LOG_COMPACT_BYTES:
+            compact_index(guild_id)
+
+
+def compact_index(guild_id):
+    """追記ログを index.json に反映してログを空にする（途中で落ちても、ログの再適用は同じ結果になる）"""
+    p = index_path(guild_id)
+    lp = index_log_path(guild_id)
+    with file_locks.hold(("ticket_index", str(guild_id))):
+        records, _ = _read_log(lp)
+        if not records:
+            return
+        atomic_write_json(p, _merge_records(_read_snapshot(p), records))
+        with open(lp, "wb"):
+            pass
+
+
+def rendered_path(guild_id, ticket_id):
+    """クローズ済みチケットの描画済みHTMLの置き場所（.gz も隣に置く）"""
+    if detail_path(guild_id, ticket_id) is None:
+        return None
+    return ticket_dir(guild_id) / "rendered" / "{}.html".format(ticket_id)
+
+
+def rendered_is_fresh(guild_id, ticket_id):
+    """描画済みHTMLがあり、ログ本体より新しいか"""
+    r = rendered_path(guild_id, ticket_id)
+    rs = _sig(r) if r is not None else None
+    if rs is None:
+        return False
+    for p in (detail_path(guild_id, ticket_id), messages_path(guild_id, ticket_id)):
+        ds = _sig(p)
+        if ds is not None and ds[0] > rs[0]:
+            return False
+    return True
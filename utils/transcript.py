@@ -0,0 +1,172 @@
+import gzip
+import itertools
+import os
+import tempfile
+from pathlib import Path
+
+# 書き出し時にまとめて書く目安（bytes）
+CHUNK_SIZE = 64 * 1024
+# 表示名をまとめて引くメッセージ数
+MESSAGE_BATCH = 200
+
+_STYLE = """
+  body{margin:0;background:#0f1117;color:#e6e6e6;font-family:system-ui,-apple-system,Segoe UI,Roboto,Helvetica,Arial}
+  .wrap{max-width:980px;margin:0 auto;padding:24px}
+  .card{background:rgba(255,255,255,.04);border:1px solid rgba(255,255,255,.08);border-radius:16px;padding:18px}
+  .h{display:flex;gap:14px;flex-wrap:wrap;align-items:center;justify-content:space-between}
+  .title{font-size:18px;font-weight:800}
+  .tag{font-size:12px;padding:6px 10px;border-radius:999px;background:rgba(88,101,242,.16);border:1px solid rgba(88,101,242,.35)}
+  .sub{opacity:.8;font-size:12px;margin-top:6px}
+  .msg{margin-top:14px;padding:12px;border-radius:14px;background:rgba(0,0,0,.25);border:1px solid rgba(255,255,255,.06)}
+  .meta{display:flex;justify-content:space-between;gap:10px;align-items:center;margin-bottom:8px}
+  .author{font-weight:700}
+  .ts{opacity:.7;font-size:12px}
+  pre.body{margin:0;white-space:pre-wrap;word-break:break-word;font-family:ui-monospace,SFMono-Regular,Menlo,Monaco,Consolas,"Liberation Mono","Courier New",monospace;font-size:13px;line-height:1.55}
+  .att{margin-top:10px;font-size:12px;opacity:.9}
+  a{color:#8ea6ff}
+  .empty{opacity:.8;padding:14px}
+"""
+
+
+def esc(s):
+    s = "" if s is None else str(s)
+    return (s.replace("&", "&amp;")
+             .replace("<", "&lt;")
+             .replace(">", "&gt;")
+             .replace('"', "&quot;"))
+
+
+def _message_html(m, names):
+    ts = esc(m.get("ts", ""))
+    an = esc(m.get("author_name") or names.get(str(m.get("author_id", ""))) or m.get("author_id", ""))
+    content = esc(m.get("content", ""))
+    links = []
+    for a in m.get("attachments") or []:
+        url = esc(a.get("url", ""))
+        fn = esc(a.get("filename", url))
+        if url:
+            links.append(f'<a href="{url}" target="_blank" rel="noopener">{fn}</a>')
+    att_html = '<div class="att">📎 ' + " / ".join(links) + "</div>" if links else ""
+    return f"""
+            <div class="msg">
+              <div class="meta"><span class="author">{an}</span><span class="ts">{ts}</span></div>
+              <pre class="body">{content}</pre>
+              {att_html}
+            </div>
+            """
+
+
+def _batch_names(batch, names):
+    if not callable(names):
+        return names or {}
+    ids = [m.get("author_id") for m in batch if not m.get("author_name") and m.get("author_id")]
+    return (names(ids) or {}) if ids else {}
+
+
+def iter_html(guild_name, ticket, detail, names=None):
+    """
+    チケットのHTMLを少しずつ返す（全文を1つの文字列にしない）。
+    detail想定:
+    {
+      "ticket_id": "...",
+      "created_at": "...",
+      "status": "open/pending/closed/locked",
+      "title": "...",
+      "messages": [
+         {"ts":"...", "author_name":"...", "author_id":"...", "content":"...", "attachments":[{"url":"...","filename":"..."}]}
+      ]
+    }
+    messages は list でもイテレータでもよい。
+    names: {uid: 表示名}、または (ids) -> {uid: 表示名}（MESSAGE_BATCH 件ごとに、author_name の無い分だけ引く）
+    """
+    detail = detail or {}
+    ticket = ticket or {}
+    title = detail.get("title") or ticket.get("title") or "Ticket"
+    tid = detail.get("ticket_id") or ticket.get("ticket_id") or "unknown"
+    status = detail.get("status") or ticket.get("status") or "unknown"
+    created = detail.get("created_at") or ticket.get("created_at") or ""
+
+    yield f"""<!doctype html>
+<html lang="ja">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width,initial-scale=1">
+<title>[{esc(guild_name or "Guild")}] Ticket {esc(tid)}</title>
+<style>{_STYLE}</style>
+</head>
+<body>
+  <div class="wrap">
+    <div class="card">
+      <div class="h">
+        <div>
+          <div class="title">{esc(title)}</div>
+          <div class="sub">Ticket ID: {esc(tid)} / Created: {esc(created)}</div>
+        </div>
+        <div class="tag">status: {esc(status)}</div>
+      </div>
+"""
+    empty = True
+    rows = iter(detail.get("messages") or [])
+    while True:
+        batch = list(itertools.islice(rows, MESSAGE_BATCH))
+        if not batch:
+            break
+        empty = False
+        got = _batch_names(batch, names)
+        for m in batch:
+            yield _message_html(m, got)
+    if empty:
+        yield '<div class="empty">（メッセージなし）</div>'
+    yield """
+    </div>
+  </div>
+</body>
+</html>"""
+
+
+def render_html(guild_name, ticket, detail, names=None):
+    return "".join(iter_html(guild_name, ticket, detail, names))
+
+
+def iter_bytes(chunks, size=CHUNK_SIZE):
+    """文字列のチャンクを UTF-8 にして size 程度にまとめる（小さい write を減らす）"""
+    buf = []
+    n = 0
+    for s in chunks:
+        b = s.encode("utf-8")
+        buf.append(b)
+        n += len(b)
+        if n >= size:
+            yield b"".join(buf)
+            buf = []
+            n = 0
+    if buf:
+        yield b"".join(buf)
+
+
+def write_cached(path, chunks):
+    """
+    path と path.gz（FileResponse が Accept-Encoding: gzip の時にそのまま返す）へ書き出す。
+    一時ファイルに書いてから置き換えるので、途中の状態が配信されることはない。
+    """
+    p = Path(path)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    gz = p.with_name(p.name + ".gz")
+    fd, tmp = tempfile.mkstemp(prefix="." + p.name + ".", suffix=".tmp", dir=str(p.parent))
+    fd_gz, tmp_gz = tempfile.mkstemp(prefix="." + gz.name + ".", suffix=".tmp", dir=str(p.parent))
+    try:
+        with os.fdopen(fd, "wb") as f, os.fdopen(fd_gz, "wb") as raw_gz:
+            with gzip.GzipFile(fileobj=raw_gz, mode="wb", mtime=0) as fgz:
+                for b in iter_bytes(chunks):
+                    f.write(b)
+                    fgz.write(b)
+        os.replace(tmp_gz, str(gz))
+        os.replace(tmp, str(p))
+    except BaseException:
+        for t in (tmp, tmp_gz):
+            try:
+                os.unlink(t)
+            except OSError:
+                pass
+        raise
+    return p